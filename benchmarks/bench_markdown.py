@@ -0,0 +1,138 @@
+"""
+Compare the MarkdownV2 converter and message splitter against the previous
+implementation: checks the outputs are identical, then times both on large inputs.
+
+    python -m benchmarks.bench_markdown [--size 200000] [--repeat 20]
+"""
+import re
+import random
+import argparse
+import timeit
+from modules.tgbot import convert_to_telegram_markdown, split_message_by_paragraphs
+
+
+def legacy_convert_to_telegram_markdown(text):
+    """
+    The converter as it was before the single-pass rewrite, kept as the reference.
+    """
+    text = text.replace('####', '')
+    text = text.replace('###', '')
+    text = text.replace('##', '')
+    text = text.replace('#', '')
+
+    replacements = [
+        (r'\*\*(.+?)\*\*', r'*\1*'),
+        (r'_(.+?)_', r'_\1_'),
+        (r'~~(.+?)~~', r'~\1~'),
+        (r'`(.+?)`', r'`\1`'),
+        (r'```([\s\S]+?)```', r'```\1```'),
+        (r'\[(.+?)\]\((.+?)\)', r'[\1](\2)'),
+    ]
+    for pattern, replacement in replacements:
+        text = re.sub(pattern, replacement, text, flags=re.DOTALL)
+
+    special_characters = r'_*\[\]()~>#+-=|{}.!'
+    escaped_text = re.sub(f'([{re.escape(special_characters)}])', r'\\\1', text)
+
+    valid_syntax = [
+        (r'\\\*', r'*'),
+        (r'\\_', r'_'),
+        (r'\\~', r'~'),
+        (r'\\`', r'`'),
+        (r'\\\[', r'['),
+        (r'\\\]', r']'),
+    ]
+    for pattern, replacement in valid_syntax:
+        escaped_text = re.sub(pattern, replacement, escaped_text)
+    return escaped_text
+
+
+def legacy_split_message_by_paragraphs(message, max_chunk_size=4096):
+    paragraphs = message.split('\n')
+    chunks = []
+    current_chunk = ""
+    for paragraph in paragraphs:
+        if len(current_chunk) + len(paragraph) + 1 > max_chunk_size:
+            chunks.append(current_chunk.strip())
+            current_chunk = paragraph
+        else:
+            current_chunk += f"\n{paragraph}"
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+SUMMARY_PARAGRAPHS = [
+    "## 📈 **Acme Corp (ACME) Beats Q3 Expectations**",
+    "Revenue rose 12.5% year-over-year to $4.2B (vs. $3.9B expected), driven by cloud + services.",
+    "- **EPS:** $1.23 (est. $1.10)!",
+    "- Gross margin: 46.1% -> up from 44.8% (see [investor deck](https://example.com/q3?x=1&y=2)).",
+    "The CFO noted ~~headwinds~~ tailwinds in EMEA; FX impact was {minor} | guidance = raised.",
+    "> \"We expect double-digit growth in FY2025,\" said the CEO. Use `code` sparingly_ok_",
+    "Q&A: analysts asked about capex (#1 topic), buybacks, and the path to 50% margins...",
+]
+
+
+def make_summary(size, seed=0):
+    rng = random.Random(seed)
+    parts, total = [], 0
+    while total < size:
+        paragraph = rng.choice(SUMMARY_PARAGRAPHS)
+        parts.append(paragraph)
+        total += len(paragraph) + 1
+    return "\n".join(parts)
+
+
+def make_noise(length, rng):
+    alphabet = "ab \n*_~`[]()#>+-=|{}.!\\"
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def check_equivalence(samples=20000, seed=1):
+    rng = random.Random(seed)
+    inputs = [make_noise(rng.randint(0, 40), rng) for _ in range(samples)]
+    inputs += [make_summary(5000, seed=i) for i in range(20)]
+    for text in inputs:
+        expected = legacy_convert_to_telegram_markdown(text)
+        actual = convert_to_telegram_markdown(text)
+        if expected != actual:
+            raise AssertionError(f"Converter output differs for {text!r}: {expected!r} != {actual!r}")
+    print(f"convert_to_telegram_markdown: identical on {len(inputs)} inputs")
+
+    for text in inputs:
+        for chunk in split_message_by_paragraphs(convert_to_telegram_markdown(text), max_chunk_size=64):
+            if len(chunk) > 64:
+                raise AssertionError(f"Chunk over the limit: {chunk!r}")
+            trailing = len(chunk) - len(chunk.rstrip('\\'))
+            if trailing % 2:
+                raise AssertionError(f"Chunk ends inside an escape sequence: {chunk!r}")
+    print("split_message_by_paragraphs: chunks within limit, no split escapes")
+
+
+def bench(label, function, argument, repeat):
+    seconds = min(timeit.repeat(lambda: function(argument), number=1, repeat=repeat))
+    print(f"{label:<45} {seconds * 1000:9.2f} ms")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=200_000, help="Characters in the benchmark input.")
+    parser.add_argument("--repeat", type=int, default=20, help="Timing repetitions (best is reported).")
+    args = parser.parse_args()
+
+    check_equivalence()
+
+    text = make_summary(args.size)
+    escaped = convert_to_telegram_markdown(text)
+    print(f"\nInput: {len(text)} characters")
+    old = bench("legacy convert_to_telegram_markdown", legacy_convert_to_telegram_markdown, text, args.repeat)
+    new = bench("convert_to_telegram_markdown", convert_to_telegram_markdown, text, args.repeat)
+    print(f"{'speedup':<45} {old / new:9.2f}x")
+    old = bench("legacy split_message_by_paragraphs", legacy_split_message_by_paragraphs, escaped, args.repeat)
+    new = bench("split_message_by_paragraphs", split_message_by_paragraphs, escaped, args.repeat)
+    print(f"{'speedup':<45} {old / new:9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
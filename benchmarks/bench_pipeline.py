@@ -0,0 +1,385 @@
+"""
+Benchmark the summarization pipeline offline, against local stand-ins for
+every external service, on a synthetic earnings day.
+
+A separate process serves API Ninjas, the Cloudflare worker store, the
+OpenAI chat completions API and the Telegram Bot API over HTTP on
+localhost. Each has its own latency, and OpenAI and Telegram have rate
+limits. The real clients talk to it, so connection pooling, retries and
+flood control are all exercised. The database is a fresh SQLite file, or the
+Postgres configured by the NEON_* variables with --postgres (set
+NEON_SSLMODE=disable for a local server).
+
+Phases:
+  cold     `process_todays_transcripts` on a day where nothing is stored yet
+  warm     the same day again: every ticker is republished from the store
+  fetch    `fetch_or_save_transcript` for new tickers, from the API
+  refetch  the same tickers again, from the database and the store cache
+
+    python -m benchmarks.bench_pipeline [--tickers 50] [--concurrency 8] [--openai-latency 0.5]
+
+OPENAI_RPM / OPENAI_TPM in the environment configure the client-side limiter;
+they default to values that do not throttle so the stub's limits apply.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+import resource
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+WORDS = (
+    "revenue grew year over year driven by strong demand in cloud services while operating margin "
+    "expanded guidance for the next quarter remains cautious given currency headwinds and supply "
+    "constraints our customers continue to invest in automation and we returned capital to shareholders"
+).split()
+
+
+def make_text(words, seed):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_transcript(ticker, words):
+    """
+    Earnings call with prepared remarks, a Q&A section and speaker turns, so chunking behaves as on real calls.
+    """
+    rng = random.Random(ticker)
+    turns = []
+    remaining = words
+    turn = 0
+    while remaining > 0:
+        size = min(remaining, rng.randint(80, 400))
+        speaker = "Operator" if turn == 0 else rng.choice(["Jane Doe", "John Smith", "Analyst One"])
+        if turn == max(1, words // 800):
+            turns.append("Operator: We will now begin the question-and-answer session.")
+        turns.append(f"{speaker}: {make_text(size, f'{ticker}-{turn}')}.")
+        remaining -= size
+        turn += 1
+    return "\n".join(turns)
+
+
+def make_calendar(tickers, year, quarter):
+    import pandas as pd
+
+    month = {1: "Mar", 2: "Jun", 3: "Sep", 4: "Dec"}[quarter]
+    rng = random.Random(len(tickers))
+    return pd.DataFrame({
+        "name": [f"{ticker} Corp" for ticker in tickers],
+        "marketCap": [f"${rng.randint(10 ** 8, 10 ** 12):,}" for _ in tickers],
+        "fiscalQuarterEnding": [f"{month}/{year}" for _ in tickers],
+        "epsForecast": [f"${rng.uniform(-1, 5):.2f}" for _ in tickers],
+        "noOfEsts": [str(rng.randint(0, 30)) for _ in tickers],
+    }, index=pd.Index(tickers, name="symbol"))
+
+
+class SlidingWindow:
+    """
+    At most `limit` events per `period` seconds; `limit` 0 means unlimited.
+    """
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.events = deque()
+        self.lock = threading.Lock()
+
+    def admit(self):
+        """
+        :return: 0 if admitted, else the seconds until a slot frees up.
+        """
+        if not self.limit:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            while self.events and self.events[0] <= now - self.period:
+                self.events.popleft()
+            if len(self.events) >= self.limit:
+                return self.events[0] + self.period - now
+            self.events.append(now)
+            return 0
+
+
+def serve_fakes(options, ready):
+    """
+    Run the stand-in HTTP server until the process is terminated.
+    :param options: Dict of latencies (seconds), limits and sizes from the command line.
+    :param ready: Queue receiving the bound port.
+    """
+    store = {}
+    store_lock = threading.Lock()
+    openai_window = SlidingWindow(options["openai_rpm"], 60)
+    telegram_window = SlidingWindow(options["telegram_per_second"], 1)
+    counters = {"messages": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body, content_type="application/json", headers=None):
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path.endswith("/earningstranscript"):
+                query = parse_qs(url.query)
+                time.sleep(options["ninjas_latency"])
+                ticker = query["ticker"][0]
+                self._reply(200, {"ticker": ticker, "transcript": make_transcript(ticker, options["transcript_words"])})
+            elif url.path.startswith("/download/"):
+                time.sleep(options["store_latency"])
+                with store_lock:
+                    data = store.get(url.path[len("/download/"):])
+                if data is None:
+                    self._reply(404, b"not found", "text/plain")
+                else:
+                    self._reply(200, data, "text/plain")
+            else:
+                self._reply(404, b"not found", "text/plain")
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            body = self._body()
+            if url.path == "/upload":
+                time.sleep(options["store_latency"])
+                header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("ascii")
+                message = BytesParser(policy=HTTP).parsebytes(header + body)
+                with store_lock:
+                    for part in message.iter_parts():
+                        store[part.get_filename()] = part.get_payload(decode=True)
+                self._reply(200, {"ok": True})
+            elif url.path.endswith("/chat/completions"):
+                wait = openai_window.admit()
+                if wait:
+                    self._reply(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                headers={"retry-after": f"{wait:.3f}"})
+                    return
+                request = json.loads(body)
+                time.sleep(options["openai_latency"] * random.uniform(0.8, 1.2))
+                prompt_tokens = len(body) // 4
+                text = make_text(options["summary_words"], len(body))
+                self._reply(200, {
+                    "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                    "model": request.get("model", "gpt-4o"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": f"**Results** {text}."}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": options["summary_words"],
+                              "total_tokens": prompt_tokens + options["summary_words"]},
+                })
+            elif url.path.endswith(("/sendMessage", "/sendDocument")):
+                wait = telegram_window.admit()
+                if wait:
+                    retry_after = max(1, round(wait))
+                    self._reply(429, {"ok": False, "error_code": 429,
+                                      "description": f"Too Many Requests: retry after {retry_after}",
+                                      "parameters": {"retry_after": retry_after}})
+                    return
+                time.sleep(options["telegram_latency"])
+                counters["messages"] += 1
+                self._reply(200, {"ok": True, "result": {
+                    "message_id": counters["messages"], "date": int(time.time()),
+                    "chat": {"id": -100123, "type": "channel"}, "text": "ok",
+                }})
+            else:
+                self._reply(404, b"not found", "text/plain")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile; None for no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(phase, count, seconds, latencies):
+    result = {
+        "phase": phase,
+        "tickers": count,
+        "seconds": round(seconds, 3),
+        "tickers_per_minute": round(count / seconds * 60, 1) if seconds else None,
+        "p50_seconds": percentile(latencies, 0.5),
+        "p99_seconds": percentile(latencies, 0.99),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    p50 = f"{result['p50_seconds']:.3f}" if latencies else "-"
+    p99 = f"{result['p99_seconds']:.3f}" if latencies else "-"
+    print(f"{phase:<8} {count:>7} {seconds:>9.2f} {result['tickers_per_minute'] or 0:>12.1f} "
+          f"{p50:>9} {p99:>9} {result['peak_rss_mb']:>10.1f}", file=sys.__stdout__)
+    return result
+
+
+def configure_environment(args, port, directory):
+    """
+    Point every client at the stand-ins. Must run before the pipeline modules are imported.
+    """
+    base_url = f"http://127.0.0.1:{port}"
+    os.environ.update({
+        "API_NINJAS_URL": f"{base_url}/v1",
+        "API_NINJAS_TOKEN": "bench",
+        "DATA_STORE_URL": base_url,
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "OPENAI_TOKEN": "bench",
+        "TG_BOT_TOKEN": "123456:bench",
+        "TG_CHANNEL_ID": "-100123",
+        "TG_MIN_SEND_INTERVAL": str(args.telegram_interval),
+        "TG_OUTBOX_PATH": os.path.join(directory, "telegram_outbox.db"),
+        "STORE_CACHE_DIR": os.path.join(directory, "store"),
+        "OPENAI_CACHE_PATH": os.path.join(directory, "openai_responses.db"),
+        "CALENDAR_CACHE_DIR": os.path.join(directory, "calendar"),
+        "WATCHLIST": "",
+        "WATCHLIST_FILE": os.path.join(directory, "watchlist.txt"),
+        "TRANSCRIPT_CHUNK_TOKENS": str(args.chunk_tokens),
+    })
+    os.environ.setdefault("OPENAI_RPM", "1000000")
+    os.environ.setdefault("OPENAI_TPM", "1000000000")
+    if args.postgres:
+        os.environ["DATABASE_URL"] = ""
+    else:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    return base_url
+
+
+async def run_phases(args, base_url):
+    import main
+    from telegram import Bot
+    from modules import tgbot
+    from modules.metrics import metrics
+    from modules.scheduler import RunBudget
+    from modules import earnings_calendar
+
+    tgbot.bot = Bot(token=os.environ["TG_BOT_TOKEN"], base_url=f"{base_url}/bot")
+    main.get_pool().init_schema()
+
+    # Tickers are unique per invocation, so a persistent Postgres starts cold too.
+    nonce = f"{int(time.time()) % 100000:05d}"
+    tickers = [f"B{nonce}{index:04d}" for index in range(args.tickers)]
+    earnings_calendar.fetch_earnings = lambda date: make_calendar(tickers, 2024, 3)
+
+    results = []
+    print(f"{'phase':<8} {'tickers':>7} {'seconds':>9} {'tickers/min':>12} {'p50 s':>9} {'p99 s':>9} {'peak MB':>10}",
+          file=sys.__stdout__)
+    phases = ["cold"] if args.skip_warm else ["cold", "warm"]
+    for phase in phases:
+        metrics.reset()
+        started = time.perf_counter()
+        await main.process_todays_transcripts(days_ago=1, max_symbols=args.tickers,
+                                              concurrency=args.concurrency, budget=RunBudget())
+        elapsed = time.perf_counter() - started
+        latencies = [span["seconds"] for span in metrics.report()["spans"] if span["stage"] == "ticker"]
+        results.append(summarize(phase, len(latencies), elapsed, latencies))
+        results[-1]["stages"] = metrics.report()["stages"]
+
+    fetch_tickers = [f"F{nonce}{index:04d}" for index in range(args.tickers)]
+    for phase in ("fetch", "refetch"):
+        latencies = []
+
+        def fetch(ticker):
+            started = time.perf_counter()
+            transcript_id, transcript = main.fetch_or_save_transcript(ticker, 2024, 3)
+            latencies.append(time.perf_counter() - started)
+            return transcript is not None
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+            fetched = sum(await asyncio.gather(*(
+                asyncio.get_running_loop().run_in_executor(executor, fetch, ticker) for ticker in fetch_tickers
+            )))
+        results.append(summarize(phase, fetched, time.perf_counter() - started, latencies))
+    await main.close_pools()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tickers", type=int, default=50, help="Tickers on the synthetic earnings day.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Tickers processed at once.")
+    parser.add_argument("--transcript-words", type=int, default=6000, help="Words per synthetic transcript.")
+    parser.add_argument("--summary-words", type=int, default=400, help="Words per stub completion.")
+    parser.add_argument("--chunk-tokens", type=int, default=8000, help="TRANSCRIPT_CHUNK_TOKENS for the run.")
+    parser.add_argument("--ninjas-latency", type=float, default=0.3, help="Seconds per API Ninjas request.")
+    parser.add_argument("--store-latency", type=float, default=0.05, help="Seconds per worker store request.")
+    parser.add_argument("--openai-latency", type=float, default=1.0, help="Mean seconds per completion.")
+    parser.add_argument("--openai-rpm", type=int, default=0, help="Completions per minute the stub allows (0: unlimited).")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Seconds per Telegram request.")
+    parser.add_argument("--telegram-per-second", type=int, default=30,
+                        help="Messages per second the stub allows (0: unlimited).")
+    parser.add_argument("--telegram-interval", type=float, default=0,
+                        help="TG_MIN_SEND_INTERVAL for the run; production uses 3.")
+    parser.add_argument("--skip-warm", action="store_true", help="Only run the cold pipeline phase.")
+    parser.add_argument("--postgres", action="store_true", help="Use the Postgres from the NEON_* variables.")
+    parser.add_argument("--log", default=None, help="Write the pipeline output to this file.")
+    parser.add_argument("--json", default=None, help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    options = {
+        "ninjas_latency": args.ninjas_latency,
+        "store_latency": args.store_latency,
+        "openai_latency": args.openai_latency,
+        "openai_rpm": args.openai_rpm,
+        "telegram_latency": args.telegram_latency,
+        "telegram_per_second": args.telegram_per_second,
+        "transcript_words": args.transcript_words,
+        "summary_words": args.summary_words,
+    }
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve_fakes, args=(options, ready), daemon=True)
+    server.start()
+    try:
+        port = ready.get(timeout=30)
+        with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as directory:
+            base_url = configure_environment(args, port, directory)
+            # The pipeline prints per ticker; keep that out of the results table.
+            log_path = args.log or os.devnull
+            with open(log_path, "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+                results = asyncio.run(run_phases(args, base_url))
+    finally:
+        server.terminate()
+        server.join()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+
+if __name__ == "__main__":
+    main()
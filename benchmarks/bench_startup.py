@@ -0,0 +1,101 @@
+"""
+Check that starting the CLI stays cheap: times `import main` and `--help` of
+every subcommand in fresh interpreters, and fails if a heavy dependency is
+imported eagerly or a command exceeds the time budget. Run it in CI or before
+merging anything that adds imports to main.py or modules/.
+
+    python -m benchmarks.bench_startup [--budget-ms 400] [--repeat 5]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Dependencies that must only be imported by the code paths that use them.
+HEAVY_MODULES = ("pandas", "finance_calendars", "openai", "telegram", "psycopg2", "asyncpg",
+                 "watchdog", "pymupdf", "fitz", "PIL", "requests", "tiktoken")
+
+COMMANDS = [None, "run", "backfill", "publish-only", "poll", "rebuild", "ingest"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code, args=()):
+    """
+    :return: Stdout of a fresh interpreter running `code` in the repository root.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", code, *args], cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return result.stdout
+
+
+def import_profile():
+    """
+    :return: Tuple of the seconds `import main` takes and the heavy modules it loaded.
+    """
+    code = (
+        "import sys, time, json\n"
+        "started = time.perf_counter()\n"
+        "import main\n"
+        "elapsed = time.perf_counter() - started\n"
+        f"heavy = [name for name in {HEAVY_MODULES!r} if name in sys.modules]\n"
+        "print(json.dumps([elapsed, heavy]))\n"
+    )
+    return json.loads(run_python(code))
+
+
+def command_seconds(command):
+    """
+    :return: Wall time of a fresh interpreter running `main.py [command] --help`, in seconds.
+    """
+    code = (
+        "import sys, time, runpy\n"
+        "started = time.perf_counter()\n"
+        "try:\n"
+        "    runpy.run_path('main.py', run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "sys.stderr.write(repr(time.perf_counter() - started))\n"
+    )
+    args = [command, "--help"] if command else ["--help"]
+    result = subprocess.run(
+        [sys.executable, "-c", code, *args], cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return float(result.stderr.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=400, help="Allowed milliseconds per measurement.")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per measurement (best is reported).")
+    args = parser.parse_args()
+
+    failures = []
+    profiles = [import_profile() for _ in range(args.repeat)]
+    seconds = min(elapsed for elapsed, heavy in profiles)
+    heavy = sorted({name for elapsed, heavy in profiles for name in heavy})
+    print(f"{'import main':<30} {seconds * 1000:9.1f} ms")
+    if heavy:
+        failures.append(f"import main loads {', '.join(heavy)}")
+    if seconds * 1000 > args.budget_ms:
+        failures.append(f"import main takes {seconds * 1000:.0f} ms")
+
+    for command in COMMANDS:
+        label = f"main.py {command + ' ' if command else ''}--help"
+        seconds = min(command_seconds(command) for _ in range(args.repeat))
+        print(f"{label:<30} {seconds * 1000:9.1f} ms")
+        if seconds * 1000 > args.budget_ms:
+            failures.append(f"{label} takes {seconds * 1000:.0f} ms")
+
+    if failures:
+        print(f"\nOver the {args.budget_ms:.0f} ms startup budget:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"\nAll within the {args.budget_ms:.0f} ms startup budget; no heavy module imported eagerly.")
+
+
+if __name__ == "__main__":
+    main()
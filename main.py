@@ -1,98 +1,113 @@
-from modules.directory_monitor import DirectoryMonitor
 import os
-from modules.prompt_preparation import PromptPreparation
-from modules.chatgpt import *
-from modules.tgbot import *
+from modules.prompt_preparation import MAP_PROMPT, REDUCE_PROMPT, PromptPreparation, fit_image_budget
+from modules.chatgpt import estimate_tokens, expected_output_tokens, get_response_cache, send_message_async
+from modules.tgbot import get_publish_queue
+from modules import tgbot
+import argparse
+import hashlib
 import asyncio
-import requests
-import psycopg2
-from finance_calendars import finance_calendars as fc
+from modules.db import get_pool, get_async_pool, get_metrics, close_pools
+from modules.storage import content_hash, get_store, get_session, stored_name
+from modules.backfill import BackfillCheckpoint, date_range, merge_symbols, parse_date
+from modules.earnings_calendar import calendar_symbols, load_calendar
+from modules.scheduler import RunBudget, rank_symbols
+from modules.poller import TranscriptJobs
+from modules.ingest import extract_file, group_by_ticker, ingest_directory, ingest_workers, pdf_mode
+from modules.metrics import current_ticker, metrics, span
 from datetime import datetime, timedelta
-import time
 from dotenv import load_dotenv
 load_dotenv()
 
 
 api_key = os.getenv('API_NINJAS_TOKEN')
 
-cloudflare_worker_url = os.getenv('DATA_STORE_URL')
 ninjas_url = os.getenv('API_NINJAS_URL')
 
-db_params = {
-    "dbname": os.getenv('NEON_DB_NAME'),
-    "user": os.getenv('NEON_USER'),
-    "password": os.getenv('NEON_PASSWORD'),
-    "host": os.getenv('NEON_HOST'),
-    "port":os.getenv('NEON_PORT'),
-    "sslmode": "require",
-}
+def store_text(pool, filename, content):
+    """
+    Upload text to the store unless an object with the same content is already recorded.
+    :param filename: Object name to use for a new upload (see `stored_name`).
+    :return: Tuple of the object name to record in the row and the content hash.
+    """
+    digest = content_hash(content)
+    with span("db_lookup"):
+        existing = pool.fetchone("select_object_by_hash", digest, digest)
+    if existing:
+        return existing[0], digest
+    get_store().upload(filename, content)
+    return filename, digest
+
+def fetch_transcript(ticker, year, quarter):
+    """
+    Fetch a transcript from API Ninjas.
+    :return: The transcript text, or None if there is none (yet).
+    """
+    api_url = f'{ninjas_url}/earningstranscript?ticker={ticker}&year={year}&quarter={quarter}'
+    with span("transcript_fetch") as fetch_span:
+        response = get_session().get(api_url, headers={'X-Api-Key': api_key})
+        fetch_span["bytes"] = len(response.content)
+
+    if response.status_code == 200 and response.json():
+        transcript = response.json().get("transcript", None)
+        if transcript:
+            return transcript
+        print("No transcript available for this request.")
+        return None
+    print("API error:", response.status_code, response.text)
+    return None
 
 # Check and fetch transcript
-def fetch_or_save_transcript(ticker, year, quarter):
+def fetch_or_save_transcript(ticker, year, quarter, transcript_id=None, lookup=True, transcript_filename=None):
+    """
+    Return the transcript for a ticker/quarter, fetching and storing it if needed.
+    :param transcript_id: Id of a transcript row already known to exist (e.g. from `plan_symbols`).
+    :param lookup: Query the database first; pass False when a plan already showed there is no row.
+    :param transcript_filename: Object name recorded in that row.
+    :return: Tuple of transcript id and transcript text, or (None, None).
+    """
     try:
         filename = f"{ticker}_{year}_Q{quarter}_earnings_call.txt"
-
-        # Connect to the database
-        connection = psycopg2.connect(**db_params)
-        cursor = connection.cursor()
+        pool = get_pool()
 
         # Check if the transcript already exists in the database
-        select_query = """
-        SELECT id, filename FROM transcripts
-        WHERE ticker = %s AND year = %s AND quarter = %s;
-        """
-        cursor.execute(select_query, (ticker, year, quarter))
-        result = cursor.fetchone()
-
-        if result:
+        if transcript_id is None and lookup:
+            with span("db_lookup"):
+                result = pool.fetchone("select_transcript", ticker, year, quarter)
+            if result:
+                transcript_id, transcript_filename = result
+
+        if transcript_id is not None:
             print("Transcript fetched from the database.")
-            transcript_id, existing_filename = result
-            worker_response = requests.get(f'{cloudflare_worker_url}/download/{filename}').text
-            # print(f'WORK_RESP: {worker_response}')
+            worker_response = get_store().download(transcript_filename or filename)
             return transcript_id, worker_response  # Return the transcript content
 
         # If not found, fetch from the API
-        api_url = f'{ninjas_url}/earningstranscript?ticker={ticker}&year={year}&quarter={quarter}'
-        response = requests.get(api_url, headers={'X-Api-Key': api_key})
-
-        if response.status_code == requests.codes.ok and response.json():
-            transcript = response.json().get("transcript", None)
-
-            if transcript:
-
-                worker_response = requests.post(
-                    f'{cloudflare_worker_url}/upload',
-                    files={"file": (filename, transcript)},
-                )
-
-                # Insert the transcript into the database
-                insert_query = """
-                INSERT INTO transcripts (ticker, year, quarter, created_at, filename)
-                VALUES (%s, %s, %s, NOW(), %s) RETURNING id;
-                """
-                cursor.execute(insert_query, (ticker, year, quarter, filename))
-                transcript_id = cursor.fetchone()[0]
-                connection.commit()
-                print("Transcript saved to the database.")
-                return transcript_id, transcript  # Return the transcript content
-
-            else:
-                print("No transcript available for this request.")
-                return None, None
-        else:
-            print("API error:", response.status_code, response.text)
+        transcript = fetch_transcript(ticker, year, quarter)
+        if transcript is None:
             return None, None
 
+        # Versioned, so a worker that loses the race below never overwrites the winner's object
+        filename, digest = store_text(pool, stored_name(filename, version=content_hash(transcript)), transcript)
+
+        # Insert the transcript into the database, unless another worker did while we were fetching
+        with span("db_write"):
+            with pool.connection() as session:
+                session.execute("lock_key", f"transcript:{ticker}:{year}:{quarter}")
+                existing = session.fetchone("select_transcript", ticker, year, quarter)
+                if not existing:
+                    transcript_id = session.fetchone("insert_transcript", ticker, year, quarter, filename, digest)[0]
+        if existing:
+            # Summarize the copy that was recorded, not the one fetched here
+            print("Transcript saved by another worker.")
+            return existing[0], get_store().download(existing[1])
+        print("Transcript saved to the database.")
+        return transcript_id, transcript  # Return the transcript content
+
     except Exception as db_error:
         print("Database error:", db_error)
         return None, None
 
-    finally:
-        if connection:
-            connection.close()
-            print("Database connection closed.")
-
-def get_earnings_symbols(date=None, days_ago=None):
+def get_earnings_symbols(date=None, days_ago=None, refresh=False):
     if days_ago is not None:
         target_date = datetime.now() - timedelta(days=days_ago)
     elif date is not None:
@@ -101,86 +116,11 @@ def get_earnings_symbols(date=None, days_ago=None):
         target_date = datetime.now()
 
     target_date = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    earnings = fc.get_earnings_by_date(target_date)
-    data = []
-    for symbol in earnings.index:
-        row = earnings.loc[symbol]
-        fiscal_quarter = row['fiscalQuarterEnding']
-        try:
-            fiscal_year, fiscal_quarter_number = parse_fiscal_data(fiscal_quarter)
-            data.append({
-                'ticker': symbol,
-                'fiscal_year': fiscal_year,
-                'fiscal_quarter': fiscal_quarter_number
-            })
-        except Exception as db_error:
-            print("Error parsing fiscal data:", db_error)
-            continue
-    return data
-
-def parse_fiscal_data(fiscal_quarter):
-    """
-    Parse fiscal year and quarter from the `fiscalQuarterEnding` field.
-
-    Args:
-        fiscal_quarter (str): A string like 'Sep/2024'.
-
-    Returns:
-        tuple: Fiscal year (int) and fiscal quarter (int).
-    """
-    month, year = fiscal_quarter.split('/')
-    year = int(year)
-
-    # Map all months to their respective quarters
-    month_to_quarter = {
-        'Jan': 1, 'Feb': 1, 'Mar': 1,
-        'Apr': 2, 'May': 2, 'Jun': 2,
-        'Jul': 3, 'Aug': 3, 'Sep': 3,
-        'Oct': 4, 'Nov': 4, 'Dec': 4,
-    }
-
-    # Get the first three characters of the month and map to a quarter
-    quarter = month_to_quarter[month[:3]]
-
-    return year, quarter
-
-async def process_todays_transcripts(days_ago=1, max_symbols=3):
-
-    symbols_today = get_earnings_symbols(days_ago=days_ago)
-
-    print(f"Processing {min(max_symbols, len(symbols_today))} symbols from {days_ago} day(s) ago.")
-    connection = psycopg2.connect(**db_params)
-    cursor = connection.cursor()
-
-    for index, symbol in enumerate(symbols_today[:max_symbols], start=1):
-        ticker = symbol['ticker']
-        year = symbol['fiscal_year']
-        quarter = symbol['fiscal_quarter']
+    with span("calendar"):
+        earnings = load_calendar(target_date, refresh=refresh)
+        return calendar_symbols(earnings)
 
-        filename = f"{ticker}_{year}_Q{quarter}_summary.txt"
-
-        # Connect to the database
-
-
-        select_query = """
-        SELECT filename FROM summaries
-        WHERE ticker = %s AND year = %s AND quarter = %s;
-        """
-        cursor.execute(select_query, (ticker, year, quarter))
-        result = cursor.fetchone()
-
-        if result:
-            print("Article fetched from the database.")
-            worker_response = requests.get(f'{cloudflare_worker_url}/download/{filename}').text
-            # print(f'WORK_RESP: {worker_response}')
-            message = f"📢 New Update for Ticker: {ticker}\n\n{worker_response}"
-            await publish_to_telegram(message)
-        else:
-            # Fetch or save the transcript
-
-
-            prompt_preparation = PromptPreparation(
-                f"""
+ANALYST_PROMPT = """
                 Imagine you are a financial analyst tasked with analyzing the following data for the ticker {ticker}. Your goal is to identify key financial results, successes, challenges, and future plans.
 
                 Start with a clear and engaging title.
@@ -195,48 +135,733 @@ async def process_todays_transcripts(days_ago=1, max_symbols=3):
                 Simplified explanations of complex financial terms as if explaining to a beginner.
                 Make the article engaging, clear, and easy to understand, but not long, try to be very precise. You can use emojis to emphasize points but avoid using Markdown formatting.
                 """
-            )
 
-            transcript_id, transcript = fetch_or_save_transcript(ticker, year, quarter)
+# Changes whenever a prompt that shapes the article changes; summaries stamped
+# with another version are regenerated by `rebuild`.
+PROMPT_VERSION = hashlib.sha256(
+    "\0".join([ANALYST_PROMPT, MAP_PROMPT, REDUCE_PROMPT]).encode("utf-8")
+).hexdigest()[:16]
+
+EMPTY_PLAN_ENTRY = {'summary_filename': None, 'transcript_id': None, 'transcript_filename': None}
+
+async def plan_symbols(pool, symbols):
+    """
+    Resolve in one query which symbols already have a summary, which only have
+    a transcript, and which need everything.
+    :param symbols: Entries as returned by `get_earnings_symbols`.
+    :return: New list in the same order, each entry extended with `status`
+        ('summarized', 'transcribed' or 'new'), `summary_filename`, `transcript_id` and `transcript_filename`.
+    """
+    keys = [(s['ticker'], s['fiscal_year'], s['fiscal_quarter']) for s in symbols]
+    found = {}
+    if keys:
+        tickers, years, quarters = (list(column) for column in zip(*keys))
+        with span("db_lookup"):
+            rows = await pool.fetchall("plan_lookup", tickers, years, quarters)
+        for ticker, year, quarter, summary_filename, transcript_id, transcript_filename in rows:
+            entry = found.setdefault((ticker, year, quarter), dict(EMPTY_PLAN_ENTRY))
+            entry['summary_filename'] = entry['summary_filename'] or summary_filename
+            if transcript_id and not entry['transcript_id']:
+                entry['transcript_id'], entry['transcript_filename'] = transcript_id, transcript_filename
+
+    plan = []
+    for symbol, key in zip(symbols, keys):
+        entry = found.get(key, EMPTY_PLAN_ENTRY)
+        if entry['summary_filename']:
+            status = 'summarized'
+        elif entry['transcript_id']:
+            status = 'transcribed'
+        else:
+            status = 'new'
+        plan.append({**symbol, **entry, 'status': status})
+    return plan
+
+async def save_summary(pool, ticker, year, quarter, filename, transcript_id, digest=None, source_hash=None):
+    """
+    Insert the summary row and link it to its source transcript in one transaction.
+    The row is stamped with `PROMPT_VERSION` and the link with the hash of the
+    transcript it was written from, so `rebuild_summaries` can find stale ones.
+    If another worker saved a summary for the key first, that one is kept.
+    :param digest: Content hash of the stored summary.
+    :param source_hash: Content hash of the source transcript.
+    :return: The summary id, or None if another worker saved one first.
+    """
+    with span("db_write"):
+        async with pool.connection() as session:
+            await session.execute("lock_key", f"summary:{ticker}:{year}:{quarter}")
+            existing = await session.fetchone("select_summary_id", ticker, year, quarter)
+            if existing and existing[0] is not None:
+                return None
+            summary_id = (await session.fetchone(
+                "insert_summary", ticker, year, quarter, filename, digest, PROMPT_VERSION
+            ))[0]
+            await session.execute("insert_summary_source", summary_id, "transcript", transcript_id, source_hash)
+    return summary_id
+
+async def summarize_transcript(ticker, transcript, budget):
+    """
+    Write the article for a transcript with the analyst prompt; transcripts
+    over the chunk size are condensed part by part first (map-reduce).
+    :return: The article, or None if its estimated cost does not fit the token budget.
+    """
+    prompt_preparation = PromptPreparation(ANALYST_PROMPT.format(ticker=ticker))
+    chunked = prompt_preparation.process_transcript(transcript)
+    # Estimate: the prompt and transcript once, plus every chunk's notes read back in the reduce step.
+    # Unchunked transcripts are already part of the prompt array.
+    content = prompt_preparation.get_prompt_array()
+    cost = estimate_tokens(content + [{"type": "text", "text": transcript}] if chunked else content)
+    cost += 2 * expected_output_tokens * len(prompt_preparation.chunks)
+    if not budget.reserve(cost):
+        print(f'{ticker}: skipped, about {cost} tokens would exceed the token budget.')
+        budget.skipped += 1
+        return None
+
+    if chunked:
+        # Map: condense every chunk in parallel, then reduce the notes into the article.
+        print(f'{ticker}: transcript split into {len(prompt_preparation.chunks)} chunks.')
+        chunk_summaries = await asyncio.gather(*(
+            send_message_async(chunk_content)
+            for chunk_content in prompt_preparation.get_map_prompt_arrays(ticker)
+        ))
+        content = prompt_preparation.get_reduce_prompt_array(chunk_summaries)
+    else:
+        content = prompt_preparation.get_prompt_array()
+    return await send_message_async(content)
+
+async def process_ticker(symbol, pool, semaphore, budget):
+    """
+    Produce the Telegram message for a single planned ticker (see `plan_symbols`).
+    Blocking HTTP calls run in the default executor and OpenAI goes through
+    the async client, so several tickers can be in flight at once, bounded by
+    the semaphore.
+    Tickers reached after the run's time budget, or whose estimated token
+    cost no longer fits its token budget, are skipped.
+    :return: The message to publish, or None if nothing is available or another
+             worker saved the summary first.
+    """
+    ticker = symbol['ticker']
+    year = symbol['fiscal_year']
+    quarter = symbol['fiscal_quarter']
+
+    # Spans of this task (and its threads) are attributed to the ticker.
+    current_ticker.set(ticker)
+
+    async with semaphore:
+        if budget.out_of_time():
+            budget.skipped += 1
+            return None
+
+        # Per-ticker latency, excluding the time spent waiting for a slot.
+        with span("ticker"):
+            if symbol['status'] == 'summarized':
+                print(f"Article for {ticker} fetched from the database.")
+                article = await asyncio.to_thread(get_store().download, symbol['summary_filename'])
+                return f"📢 New Update for Ticker: {ticker}\n\n{article}"
+
+            transcript_id, transcript = await asyncio.to_thread(
+                fetch_or_save_transcript, ticker, year, quarter,
+                transcript_id=symbol['transcript_id'], lookup=False,
+                transcript_filename=symbol['transcript_filename'],
+            )
             if transcript == None:
-                continue
+                return None
             print(f'ID: {transcript_id} TRANSCRIPT: {len(transcript)}')
 
-            prompt_preparation.process_txt(transcript)
-            content = prompt_preparation.get_prompt_array()
-            gpt_response = send_message(content)
-            insert_query = """
-            INSERT INTO summaries (ticker, year, quarter, filename)
-            VALUES (%s, %s, %s, %s) RETURNING id;
-            """
-            cursor.execute(insert_query, (ticker, year, quarter, filename))
-            summary_id = cursor.fetchone()[0]
+            gpt_response = await summarize_transcript(ticker, transcript, budget)
+            if gpt_response is None:
+                return None
+
+            # Versioned, so a worker that loses the race in save_summary never overwrites the winner's object
+            name = stored_name(f"{ticker}_{year}_Q{quarter}_summary.txt", version=content_hash(gpt_response))
+            filename, digest = await asyncio.to_thread(store_text, get_pool(), name, gpt_response)
+            summary_id = await save_summary(pool, ticker, year, quarter, filename, transcript_id, digest,
+                                            content_hash(transcript))
+            if summary_id is None:
+                # The worker that saved it first publishes it.
+                print(f"{ticker}: summary already saved by another worker.")
+                return None
             print(f'SUMMARY_ID: {summary_id}')
+            return f"📢 New Update for Ticker: {ticker}\n\n{gpt_response}"
+
+def register_collectors(publish_queue, budget=None):
+    """
+    Include the stats of the shared clients in the exported metrics.
+    """
+    metrics.add_collector("db", get_metrics)
+    metrics.add_collector("store", lambda: get_store().get_stats())
+    metrics.add_collector("openai_cache", lambda: get_response_cache().get_stats())
+    metrics.add_collector("telegram", publish_queue.get_stats)
+    if budget is not None:
+        metrics.add_collector("budget", budget.get_stats)
+
+async def process_symbols(symbols, max_symbols=None, concurrency=1, skip_summarized=False, on_done=None,
+                          budget=None):
+    """
+    Plan, summarize and publish a list of symbols, highest priority first (see `rank_symbols`).
+    :param symbols: Entries as returned by `get_earnings_symbols`.
+    :param max_symbols: Only process the `max_symbols` highest-priority entries of the plan.
+    :param concurrency: Number of tickers processed at the same time.
+    :param skip_summarized: Leave out symbols that already have a summary instead of republishing them.
+    :param on_done: Called with each plan entry once its message has been queued.
+    :param budget: `RunBudget` limiting wall time and OpenAI tokens for the run.
+    """
+    budget = budget or RunBudget()
+    pool = await get_async_pool()
+    plan = await plan_symbols(pool, rank_symbols(symbols))
+    counts = {status: sum(1 for entry in plan if entry['status'] == status)
+              for status in ('summarized', 'transcribed', 'new')}
+    print(f"Plan: {counts}")
+    if skip_summarized:
+        for entry in plan:
+            if entry['status'] == 'summarized' and on_done:
+                on_done(entry)
+        plan = [entry for entry in plan if entry['status'] != 'summarized']
+    plan = plan[:max_symbols]
+    print(f"Processing {len(plan)} symbols with concurrency {concurrency}.")
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    publish_queue = get_publish_queue()
+    register_collectors(publish_queue, budget)
+
+    tasks = [
+        asyncio.create_task(process_ticker(symbol, pool, semaphore, budget))
+        for symbol in plan
+    ]
 
+    try:
+        # Queue in priority order; the publish queue paces the actual posts.
+        for symbol, task in zip(plan, tasks):
+            try:
+                message = await task
+            except Exception as e:
+                print(f"Failed to process ticker {symbol['ticker']}: {e}")
+                continue
+            if message is None:
+                continue
+            publish_queue.enqueue(message)
+            if on_done:
+                on_done(symbol)
+        await publish_queue.drain()
+    finally:
+        for task in tasks:
+            task.cancel()
+        print(f"Database pool metrics: {get_metrics()}")
+        print(f"Store cache stats: {get_store().get_stats()}")
+        print(f"OpenAI cache stats: {get_response_cache().get_stats()}")
+        print(f"Telegram publish stats: {publish_queue.get_stats()}")
+        print(f"Run budget: {budget.get_stats()}")
+
+async def process_todays_transcripts(days_ago=1, max_symbols=3, concurrency=1, refresh_calendar=False,
+                                     budget=None):
+    """
+    Summarize and publish the earnings transcripts from `days_ago` day(s) ago.
+    :param concurrency: Number of tickers processed at the same time.
+    :param refresh_calendar: Fetch the earnings calendar even if a fresh cached copy exists.
+    :param budget: Optional `RunBudget`.
+    """
+    symbols_today = get_earnings_symbols(days_ago=days_ago, refresh=refresh_calendar)
+    print(f"Found {len(symbols_today)} symbols from {days_ago} day(s) ago.")
+    try:
+        await process_symbols(symbols_today, max_symbols=max_symbols, concurrency=concurrency, budget=budget)
+    finally:
+        await close_pools()
 
+async def publish_pending(days_ago=None, max_symbols=None):
+    """
+    Publish what is already written, without fetching or summarizing anything:
+    the messages left in the Telegram outbox and, given `days_ago`, the stored
+    summaries of that earnings calendar day.
+    """
+    publish_queue = get_publish_queue()
+    try:
+        if days_ago is not None:
+            symbols = await asyncio.to_thread(get_earnings_symbols, days_ago=days_ago)
+            plan = await plan_symbols(await get_async_pool(), rank_symbols(symbols))
+            plan = [entry for entry in plan if entry['status'] == 'summarized'][:max_symbols]
+            print(f"Publishing {len(plan)} stored summaries from {days_ago} day(s) ago.")
+            for entry in plan:
+                article = await asyncio.to_thread(get_store().download, entry['summary_filename'])
+                publish_queue.enqueue(f"📢 New Update for Ticker: {entry['ticker']}\n\n{article}")
+        await publish_queue.drain()
+        print(f"Telegram publish stats: {publish_queue.get_stats()}")
+    finally:
+        await close_pools()
 
-            connection.commit()
+async def backfill_transcripts(start_date, end_date, max_symbols=None, concurrency=1, budget=None):
+    """
+    Summarize and publish every earnings call between two dates (inclusive).
+    Calendars for all days are fetched concurrently and merged, so a ticker
+    listed on several days is only processed once. Progress is checkpointed
+    (see `BackfillCheckpoint`); re-running the same range resumes it.
+    Symbols that already have a summary are not republished.
+    """
+    checkpoint = BackfillCheckpoint.for_range(start_date, end_date)
+    days = list(date_range(start_date, end_date))
+    missing_days = [day for day in days if not checkpoint.has_day(day)]
+    print(f"Backfilling {len(days)} day(s); fetching {len(missing_days)} calendar(s).")
+
+    calendars = await asyncio.gather(
+        *(asyncio.to_thread(get_earnings_symbols, date=day) for day in missing_days),
+        return_exceptions=True,
+    )
+    for day, symbols in zip(missing_days, calendars):
+        if isinstance(symbols, Exception):
+            print(f"Failed to fetch the earnings calendar for {day:%Y-%m-%d}: {symbols}")
+            continue
+        checkpoint.save_day(day, symbols)
 
-            insert_source_query = """
-                INSERT INTO summary_sources (summary_id, source_type, source_id)
-                VALUES (%s, %s, %s);
-            """
-            cursor.execute(insert_source_query, (summary_id, "transcript", transcript_id))
-            connection.commit()
+    merged = merge_symbols(checkpoint.symbols_for(day) for day in days)
+    pending = [symbol for symbol in merged if not checkpoint.is_done(symbol)]
+    print(f"{len(merged)} unique symbols, {len(merged) - len(pending)} already done.")
+    try:
+        await process_symbols(pending, max_symbols=max_symbols, concurrency=concurrency,
+                              skip_summarized=True, on_done=checkpoint.mark_done, budget=budget)
+    finally:
+        await close_pools()
 
-            requests.post(
-                f'{cloudflare_worker_url}/upload',
-                files={"file": (filename, gpt_response)},
-            )
-            message = f"📢 New Update for Ticker: {ticker}\n\n{gpt_response}"
-            await publish_to_telegram(message)
+async def poll_transcripts(days=2, interval=300, batch_size=20, concurrency=1, budget=None, register=True):
+    """
+    Run until interrupted, publishing each summary as soon as its transcript
+    appears. Calendar entries from the last `days` days (today included) are
+    registered as jobs (see `TranscriptJobs`); every `interval` seconds a
+    batch of due jobs goes through the pipeline, and jobs whose transcript is
+    not out yet are re-polled later with exponential backoff.
+    Jobs are leased, so several pollers (processes or hosts) can share the
+    job table, each working on different tickers.
+    :param register: Register calendar entries as jobs; pure workers only claim them.
+    """
+    pool = await get_async_pool()
+    jobs = TranscriptJobs(pool)
+    print(f"Worker {jobs.owner} started.")
+    try:
+        while True:
+            for days_ago in range(days if register else 0):
+                try:
+                    symbols = await asyncio.to_thread(get_earnings_symbols, days_ago=days_ago)
+                    await jobs.add(symbols)
+                except Exception as e:
+                    print(f"Failed to register calendar jobs for {days_ago} day(s) ago: {e}")
+
+            # A failed round (e.g. the database or network dropping out) is retried next
+            # interval; jobs it could not finish stay leased until their lease runs out.
+            try:
+                due = await jobs.claim(batch_size)
+                while due:
+                    print(f"Polling {len(due)} pending transcript(s).")
+                    done_keys = set()
+                    keep_alive = asyncio.create_task(jobs.keep_alive())
+                    try:
+                        await process_symbols(
+                            due, concurrency=concurrency, skip_summarized=True, budget=budget,
+                            on_done=lambda s: done_keys.add((s['ticker'], s['fiscal_year'], s['fiscal_quarter'])),
+                        )
+                    except Exception as e:
+                        print(f"Failed to process {len(due)} job(s): {e}")
+                    finally:
+                        keep_alive.cancel()
+                    done, pending, expired = await jobs.finish(due, done_keys)
+                    print(f"Jobs: {done} done, {pending} rescheduled, {expired} expired.")
+                    if budget and budget.out_of_time():
+                        return
+                    due = await jobs.claim(batch_size)
+            except Exception as e:
+                print(f"Polling round failed, retrying in {interval}s: {e}")
+
+            if budget and budget.out_of_time():
+                return
+            await asyncio.sleep(interval)
+    finally:
+        await close_pools()
 
-        await asyncio.sleep(5)
+def run_poll_worker(index, options):
+    """
+    Entry point of a `poll --processes` child process.
+    :param index: Position of the process; only the first one registers calendar jobs.
+    :param options: Keyword arguments for `poll_transcripts`, with `max_seconds`
+        and `max_tokens` for its budget instead of the budget itself.
+    """
+    budget = RunBudget(max_seconds=options.pop('max_seconds'), max_tokens=options.pop('max_tokens'))
+    register = options.pop('register', True) and index == 0
+    # A shared outbox would have each process resend the others' in-flight messages.
+    root, extension = os.path.splitext(tgbot.outbox_path)
+    tgbot.outbox_path = f"{root}-{index}{extension}"
+    try:
+        asyncio.run(poll_transcripts(**options, budget=budget, register=register))
+    except KeyboardInterrupt:
+        pass
 
-    if connection:
-        connection.close()
+def run_poll_workers(processes, options):
+    """
+    Run `processes` pollers as local processes sharing the job table, until they all exit.
+    """
+    import multiprocessing
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_poll_worker, args=(index, dict(options)), name=f"poll-{index}")
+        for index in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join()
+
+def is_stale(entry):
+    """
+    Whether a summary from `latest_summaries` was written with another prompt
+    version or from a different transcript than the one stored now.
+    """
+    return (entry['prompt_version'] != PROMPT_VERSION
+            or entry['source_hash'] is None
+            or entry['source_hash'] != entry['transcript_hash'])
+
+def refetch_transcript(entry):
+    """
+    Fetch a summary's transcript from API Ninjas again and, if it changed,
+    store it and update the transcript row.
+    :return: True if the transcript changed.
+    """
+    transcript = fetch_transcript(entry['ticker'], entry['year'], entry['quarter'])
+    if transcript is None or content_hash(transcript) == entry['transcript_hash']:
+        return False
+    pool = get_pool()
+    name = stored_name(f"{entry['ticker']}_{entry['year']}_Q{entry['quarter']}_earnings_call.txt",
+                       version=content_hash(transcript))
+    filename, digest = store_text(pool, name, transcript)
+    with span("db_write"):
+        pool.execute("update_transcript", filename, digest, entry['transcript_id'])
+    entry.update(transcript_filename=filename, transcript_hash=digest, transcript=transcript)
+    return True
+
+async def rebuild_summary(entry, pool, semaphore, budget):
+    """
+    Regenerate one stale summary and restamp its row. The new text is stored
+    under a new object name (see `stored_name`); the old object is left as is.
+    :return: True if it was rebuilt, False if skipped for the budget.
+    """
+    ticker = entry['ticker']
+    current_ticker.set(ticker)
+    async with semaphore:
+        if budget.out_of_time():
+            budget.skipped += 1
+            return False
+        with span("ticker"):
+            transcript = entry.get('transcript')
+            if transcript is None:
+                transcript = await asyncio.to_thread(get_store().download, entry['transcript_filename'])
+            source_hash = content_hash(transcript)
+            if entry['transcript_hash'] is None:
+                # Transcript stored before hashes were recorded.
+                with span("db_write"):
+                    await pool.execute("update_transcript", entry['transcript_filename'], source_hash,
+                                       entry['transcript_id'])
+
+            gpt_response = await summarize_transcript(ticker, transcript, budget)
+            if gpt_response is None:
+                return False
+
+            name = stored_name(f"{ticker}_{entry['year']}_Q{entry['quarter']}_summary.txt",
+                               version=content_hash(gpt_response))
+            filename, digest = await asyncio.to_thread(store_text, get_pool(), name, gpt_response)
+            with span("db_write"):
+                async with pool.connection() as session:
+                    await session.execute("update_summary", filename, digest, PROMPT_VERSION, entry['summary_id'])
+                    await session.execute("update_summary_source", source_hash, entry['summary_id'],
+                                          entry['transcript_id'])
+            print(f"{ticker} {entry['year']} Q{entry['quarter']}: summary rebuilt.")
+            return True
+
+async def rebuild_summaries(max_summaries=None, concurrency=1, refetch=False, dry_run=False, budget=None):
+    """
+    Regenerate stale summaries: those written with another `PROMPT_VERSION`,
+    or from a transcript that has changed since. Summaries are rewritten in
+    place, newest quarter first, and are not republished.
+    :param max_summaries: Rebuild at most this many.
+    :param refetch: First fetch every summarized transcript from API Ninjas
+        again, so corrected transcripts are picked up.
+    :param dry_run: Only list what would be rebuilt.
+    :param budget: `RunBudget` limiting wall time and OpenAI tokens.
+    """
+    budget = budget or RunBudget()
+    pool = await get_async_pool()
+    try:
+        with span("db_lookup"):
+            rows = await pool.fetchall("latest_summaries")
+        entries = [
+            {'summary_id': summary_id, 'ticker': ticker, 'year': year, 'quarter': quarter,
+             'prompt_version': prompt_version, 'source_hash': source_hash, 'transcript_id': transcript_id,
+             'transcript_filename': transcript_filename, 'transcript_hash': transcript_hash}
+            for (summary_id, ticker, year, quarter, prompt_version, source_hash,
+                 transcript_id, transcript_filename, transcript_hash) in rows
+        ]
+        if refetch:
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+
+            async def refetch_one(entry):
+                async with semaphore:
+                    return await asyncio.to_thread(refetch_transcript, entry)
+
+            changed = await asyncio.gather(*(refetch_one(entry) for entry in entries), return_exceptions=True)
+            for entry, result in zip(entries, changed):
+                if isinstance(result, Exception):
+                    print(f"Failed to refetch the transcript for {entry['ticker']}: {result}")
+            print(f"{sum(result is True for result in changed)} transcript(s) changed upstream.")
+
+        stale = [entry for entry in entries if is_stale(entry)]
+        print(f"{len(stale)} of {len(entries)} summaries are stale (prompt version {PROMPT_VERSION}).")
+        stale = stale[:max_summaries]
+        if dry_run:
+            for entry in stale:
+                print(f"  {entry['ticker']} {entry['year']} Q{entry['quarter']}")
+            return
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        results = await asyncio.gather(
+            *(rebuild_summary(entry, pool, semaphore, budget) for entry in stale),
+            return_exceptions=True,
+        )
+        for entry, result in zip(stale, results):
+            if isinstance(result, Exception):
+                print(f"Failed to rebuild {entry['ticker']} {entry['year']} Q{entry['quarter']}: {result}")
+        rebuilt = sum(result is True for result in results)
+        print(f"Rebuilt {rebuilt} of {len(stale)} stale summaries.")
+        print(f"Run budget: {budget.get_stats()}")
+    finally:
+        await close_pools()
+
+async def ingest_ticker(ticker, files, executor, semaphore, mode):
+    """
+    Summarize the documents dropped for one ticker into a single message.
+    Files are extracted in parallel in the worker processes and attached in
+    name order to one prompt.
+    :return: The message to publish, or None if nothing could be extracted.
+    """
+    loop = asyncio.get_running_loop()
+    current_ticker.set(ticker)
+    async with semaphore:
+        extracted = await asyncio.gather(
+            *(loop.run_in_executor(executor, extract_file, file_path, mode) for file_path in files),
+            return_exceptions=True,
+        )
+        prompt_preparation = PromptPreparation(ANALYST_PROMPT.format(ticker=ticker))
+        for file_path, parts in zip(files, extracted):
+            if isinstance(parts, Exception):
+                print(f"Failed to extract {file_path}: {parts}")
+                continue
+            prompt_preparation.get_prompt_array().extend(parts)
+        # Every file was fitted to the image budget on its own; the merged prompt must fit it as a whole.
+        content = fit_image_budget(prompt_preparation.get_prompt_array())
+        if len(content) == 1:
+            return None
+
+        print(f"{ticker}: summarizing {len(files)} dropped file(s).")
+        gpt_response = await send_message_async(content)
+        return f"📢 New Update for Ticker: {ticker}\n\n{gpt_response}"
+
+async def ingest_documents(directory=None, workers=None, mode=None, concurrency=1):
+    """
+    Run until interrupted, summarizing PDF and TXT filings dropped into a folder.
+    `DirectoryMonitor` batches new files; they are grouped by ticker (see
+    `document_ticker`), extracted in a process pool and published like
+    transcript summaries.
+    :param directory: Drop folder, INGEST_DIR by default.
+    :param workers: Extraction processes, INGEST_WORKERS by default.
+    :param mode: PDF handling, "text" or "images"; INGEST_PDF_MODE by default.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from modules.directory_monitor import DirectoryMonitor
+
+    directory = directory or ingest_directory
+    os.makedirs(directory, exist_ok=True)
+    monitor = DirectoryMonitor(directory)
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    publish_queue = get_publish_queue()
+    register_collectors(publish_queue)
+    try:
+        # Forking now would copy the observer thread's and the event loop's held locks into the workers.
+        with ProcessPoolExecutor(max_workers=workers or ingest_workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            async for files in monitor.batches():
+                groups = group_by_ticker(files, directory)
+                tasks = [
+                    asyncio.create_task(ingest_ticker(ticker, files, executor, semaphore, mode or pdf_mode))
+                    for ticker, files in groups.items()
+                ]
+                for ticker, task in zip(groups, tasks):
+                    try:
+                        message = await task
+                    except Exception as e:
+                        print(f"Failed to ingest documents for {ticker}: {e}")
+                        continue
+                    if message is not None:
+                        publish_queue.enqueue(message)
+                await publish_queue.drain()
+    finally:
+        await close_pools()
+
+
+def common_options(subcommand=False):
+    """
+    Options every command accepts, before or after the subcommand name.
+    :param subcommand: Build the copy for the subcommands. Its defaults are
+        suppressed, so a value given before the subcommand is not reset.
+    :return: Parser to pass in `parents`.
+    """
+    def default(value):
+        return argparse.SUPPRESS if subcommand else value
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--concurrency", type=int, default=default(1),
+                        help="Number of tickers processed at once. Raise it carefully, upstream APIs are rate limited.")
+    common.add_argument("--init-schema", action="store_true", default=default(False),
+                        help="Create missing tables and indexes before running.")
+    common.add_argument("--time-budget", type=float, default=default(None),
+                        help="Minutes after which no new ticker is started.")
+    common.add_argument("--token-budget", type=int, default=default(None),
+                        help="Estimated OpenAI tokens the run may spend.")
+    common.add_argument("--metrics-port", type=int, default=default(None),
+                        help="Serve Prometheus metrics on this port at /metrics while running.")
+    common.add_argument("--report", default=default(None),
+                        help="Write a JSON run report with per-stage and per-ticker timings to this file.")
+    common.add_argument("--profile", default=default(None),
+                        help="Profile the run with cProfile and save the stats to this file.")
+    return common
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(process_todays_transcripts(days_ago=1, max_symbols=10))
+    parser = argparse.ArgumentParser(description="Summarize earnings call transcripts and publish them to Telegram.",
+                                     parents=[common_options()])
+    common = common_options(subcommand=True)
+    parser.set_defaults(days_ago=1, max_symbols=10, refresh_calendar=False)
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", parents=[common], help="Process one earnings calendar day (the default).")
+    run_parser.add_argument("--days-ago", type=int, default=1, help="Earnings calendar day to process.")
+    run_parser.add_argument("--max-symbols", type=int, default=10, help="Maximum number of tickers to process.")
+    run_parser.add_argument("--refresh-calendar", action="store_true",
+                            help="Ignore the cached earnings calendar for the day.")
+
+    backfill_parser = subparsers.add_parser(
+        "backfill", parents=[common], help="Process every earnings day in a date range.")
+    backfill_parser.add_argument("start", type=parse_date, help="First day, YYYY-MM-DD.")
+    backfill_parser.add_argument("end", type=parse_date, help="Last day (inclusive), YYYY-MM-DD.")
+    backfill_parser.add_argument("--max-symbols", type=int, default=None,
+                                 help="Maximum number of tickers to process in this invocation.")
+    publish_parser = subparsers.add_parser(
+        "publish-only", parents=[common], help="Send undelivered Telegram messages and, optionally, a day's stored summaries.")
+    publish_parser.add_argument("--days-ago", type=int, default=None,
+                                help="Also publish the summaries already stored for this earnings calendar day.")
+    publish_parser.add_argument("--max-symbols", type=int, default=None, help="Maximum number of summaries to publish.")
+    poll_parser = subparsers.add_parser(
+        "poll", parents=[common], help="Keep polling for new transcripts and publish them as they appear.")
+    poll_parser.add_argument("--days", type=int, default=2,
+                             help="Register calendar entries from this many days back, today included.")
+    poll_parser.add_argument("--interval", type=int, default=300, help="Seconds between polling rounds.")
+    poll_parser.add_argument("--batch-size", type=int, default=20, help="Jobs processed per batch.")
+    poll_parser.add_argument("--processes", type=int, default=1,
+                             help="Local worker processes; more can run on other hosts against the same database.")
+    poll_parser.add_argument("--no-register", action="store_true",
+                             help="Only work on jobs other pollers register from the earnings calendar.")
+    rebuild_parser = subparsers.add_parser(
+        "rebuild", parents=[common], help="Regenerate summaries written with an older prompt or from a since-corrected transcript.")
+    rebuild_parser.add_argument("--max-summaries", type=int, default=None, help="Rebuild at most this many.")
+    rebuild_parser.add_argument("--refetch-transcripts", action="store_true",
+                                help="Fetch summarized transcripts from API Ninjas again to pick up corrections.")
+    rebuild_parser.add_argument("--dry-run", action="store_true", help="Only list the stale summaries.")
+    ingest_parser = subparsers.add_parser(
+        "ingest", parents=[common], help="Watch a folder and summarize the PDF and TXT files dropped into it.")
+    ingest_parser.add_argument("directory", nargs="?", default=None,
+                               help="Drop folder; files go in a folder named after the ticker or start with 'TICKER_'.")
+    ingest_parser.add_argument("--workers", type=int, default=None, help="Processes extracting documents.")
+    ingest_parser.add_argument("--pdf-mode", choices=("text", "images"), default=None,
+                               help="Send PDF text or rendered page images to the model.")
+    args = parser.parse_args()
+
+    if args.init_schema:
+        get_pool().init_schema()
+
+    budget = RunBudget(
+        max_seconds=args.time_budget * 60 if args.time_budget is not None else None,
+        max_tokens=args.token_budget,
+    )
+
+    if args.command == "ingest":
+        run = ingest_documents(
+            args.directory,
+            workers=args.workers,
+            mode=args.pdf_mode,
+            concurrency=args.concurrency,
+        )
+    elif args.command == "rebuild":
+        run = rebuild_summaries(
+            max_summaries=args.max_summaries,
+            concurrency=args.concurrency,
+            refetch=args.refetch_transcripts,
+            dry_run=args.dry_run,
+            budget=budget,
+        )
+    elif args.command == "publish-only":
+        run = publish_pending(days_ago=args.days_ago, max_symbols=args.max_symbols)
+    elif args.command == "poll" and args.processes > 1:
+        # Each process keeps its own budget, metrics and connections.
+        run = None
+        run_poll_workers(args.processes, {
+            'days': args.days,
+            'interval': args.interval,
+            'batch_size': args.batch_size,
+            'concurrency': args.concurrency,
+            'register': not args.no_register,
+            'max_seconds': budget.max_seconds,
+            'max_tokens': budget.max_tokens,
+        })
+    elif args.command == "poll":
+        run = poll_transcripts(
+            days=args.days,
+            interval=args.interval,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            budget=budget,
+            register=not args.no_register,
+        )
+    elif args.command == "backfill":
+        run = backfill_transcripts(
+            args.start,
+            args.end,
+            max_symbols=args.max_symbols,
+            concurrency=args.concurrency,
+            budget=budget,
+        )
+    else:
+        run = process_todays_transcripts(
+            days_ago=args.days_ago,
+            max_symbols=args.max_symbols,
+            concurrency=args.concurrency,
+            refresh_calendar=args.refresh_calendar,
+            budget=budget,
+        )
+
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+    # Only the main thread is profiled; work in `asyncio.to_thread` shows up as waits.
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    try:
+        if profiler:
+            profiler.enable()
+        if run is not None:
+            asyncio.run(run)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            import pstats
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+        if args.report:
+            metrics.write_report(args.report, command=args.command or "run", budget=budget.get_stats())
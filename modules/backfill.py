@@ -0,0 +1,110 @@
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+
+
+checkpoint_dir = os.getenv('BACKFILL_CHECKPOINT_DIR', os.path.join('.cache', 'backfill'))
+
+
+def date_range(start_date, end_date):
+    """
+    Every calendar day from `start_date` to `end_date`, both included.
+    """
+    day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day <= end_date:
+        yield day
+        day += timedelta(days=1)
+
+
+class BackfillCheckpoint:
+    """
+    Progress of a backfill, kept on disk so an interrupted run can resume.
+    The earnings calendar fetched for each day is written once to its own
+    JSON file, and every (ticker, year, quarter) that has been fully processed
+    is appended as one line to `done.jsonl`, so recording progress costs the
+    same however long the backfill is.
+    """
+    def __init__(self, path):
+        """
+        :param path: Directory of the checkpoint.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.days = {}  # 'YYYY-MM-DD' -> symbols as returned by get_earnings_symbols
+        self.done = set()
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".json"):
+                    with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                        self.days[name[:-len(".json")]] = json.load(f)
+        try:
+            with open(self._done_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self.done.add(tuple(json.loads(line)))
+                    except ValueError:
+                        pass  # Line cut short by a crash.
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def for_range(cls, start_date, end_date):
+        name = f"{start_date:%Y-%m-%d}_{end_date:%Y-%m-%d}"
+        return cls(os.path.join(checkpoint_dir, name))
+
+    @property
+    def _done_path(self):
+        return os.path.join(self.path, "done.jsonl")
+
+    def has_day(self, day):
+        return f"{day:%Y-%m-%d}" in self.days
+
+    def save_day(self, day, symbols):
+        name = f"{day:%Y-%m-%d}"
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            temp_path = os.path.join(self.path, f"{name}.json.tmp")
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(symbols, f)
+            os.replace(temp_path, os.path.join(self.path, f"{name}.json"))
+            self.days[name] = symbols
+
+    def symbols_for(self, day):
+        return self.days.get(f"{day:%Y-%m-%d}", [])
+
+    def is_done(self, symbol):
+        return (symbol['ticker'], symbol['fiscal_year'], symbol['fiscal_quarter']) in self.done
+
+    def mark_done(self, symbol):
+        key = (symbol['ticker'], symbol['fiscal_year'], symbol['fiscal_quarter'])
+        with self.lock:
+            if key in self.done:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._done_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(key) + "\n")
+            self.done.add(key)
+
+
+def merge_symbols(symbol_lists):
+    """
+    Merge per-day symbol lists, keeping the first occurrence of every
+    (ticker, year, quarter) in day order.
+    """
+    merged = []
+    seen = set()
+    for symbols in symbol_lists:
+        for symbol in symbols:
+            key = (symbol['ticker'], symbol['fiscal_year'], symbol['fiscal_quarter'])
+            if key not in seen:
+                seen.add(key)
+                merged.append(symbol)
+    return merged
+
+
+def parse_date(value):
+    """
+    argparse type for YYYY-MM-DD dates.
+    """
+    return datetime.strptime(value, "%Y-%m-%d")
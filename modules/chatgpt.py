@@ -1,19 +1,404 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import Future
+from modules.metrics import span
+from modules.prompt_preparation import count_tokens, content_image_tokens, serialize_content
 load_dotenv()
 
-client = OpenAI(
-    api_key=os.getenv('OPENAI_TOKEN'),
-)
+# Built on first use by `get_client` and `get_async_client`; importing openai is slow.
+client = None
+async_client = None
 
-def send_message(content):
-    response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "user", "content": content}
+# Limits of our OpenAI usage tier, shared by every concurrent request.
+requests_per_minute = int(os.getenv('OPENAI_RPM', '500'))
+tokens_per_minute = int(os.getenv('OPENAI_TPM', '30000'))
+expected_output_tokens = int(os.getenv('OPENAI_EXPECTED_OUTPUT_TOKENS', '1000'))
+max_attempts = int(os.getenv('OPENAI_MAX_ATTEMPTS', '6'))
 
-            ],
-        )
+cache_path = os.getenv('OPENAI_CACHE_PATH', os.path.join('.cache', 'openai_responses.db'))
+cache_ttl = float(os.getenv('OPENAI_CACHE_TTL_DAYS', '30')) * 24 * 3600
+cache_max_bytes = int(os.getenv('OPENAI_CACHE_MAX_MB', '256')) * 1024 * 1024
+
+
+class ResponseCache:
+    """
+    Persistent cache of chat completions in a local SQLite file, with TTL and
+    total-size eviction (least recently used first).
+    """
+    def __init__(self, path, ttl, max_bytes):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0}
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+        """)
+        self.connection.commit()
+
+    def get(self, key):
+        """
+        :return: The cached response text, or None if missing or expired.
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND created_at > ?;",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?;", (now, key))
+            self.connection.commit()
+            self.stats["hits"] += 1
+            return row[0]
+
+    def put(self, key, model, response):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?);",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+            self.connection.commit()
+
+    def _evict(self, now):
+        self.connection.execute("DELETE FROM responses WHERE created_at <= ?;", (now - self.ttl,))
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses;").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at;"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM responses WHERE key = ?;", (key,))
+            total -= size
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+_response_cache = None
+_in_flight = {}
+_lock = threading.Lock()
+
+
+def get_client():
+    global client
+    with _lock:
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(
+                api_key=os.getenv('OPENAI_TOKEN'),
+            )
+        return client
+
+
+def get_async_client():
+    global async_client
+    with _lock:
+        if async_client is None:
+            from openai import AsyncOpenAI
+            async_client = AsyncOpenAI(
+                api_key=os.getenv('OPENAI_TOKEN'),
+                max_retries=0,  # Retries are handled by `send_message_async`.
+            )
+        return async_client
+
+
+def get_response_cache():
+    global _response_cache
+    with _lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(cache_path, cache_ttl, cache_max_bytes)
+        return _response_cache
+
+
+def cache_key(content, model):
+    """
+    Stable hash of everything that determines the completion.
+    """
+    # Image references are keyed by what they render from, without encoding them.
+    payload = json.dumps({"model": model, "content": content}, sort_keys=True, ensure_ascii=False,
+                         default=lambda image: image.fingerprint())
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _create(content, model):
+    with span("llm") as llm_span:
+        response = get_client().chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "user", "content": serialize_content(content)}
+
+                ],
+            )
+        llm_span["tokens"] = _used_tokens(response, content)
     # return "response"
     return response.choices[0].message.content
+
+
+def _used_tokens(response, content):
+    usage = getattr(response, "usage", None)
+    if usage is not None and usage.total_tokens:
+        return usage.total_tokens
+    return estimate_tokens(content)
+
+
+def send_message(content, model="gpt-4o", use_cache=True):
+    """
+    Send a prompt array to the chat model.
+    Responses are cached on disk, and identical requests made while one is
+    already in flight wait for it instead of calling the API again.
+    :param use_cache: Set to False to always call the API.
+    """
+    if not use_cache:
+        return _create(content, model)
+
+    cache = get_response_cache()
+    key = cache_key(content, model)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    with _lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _in_flight[key] = future
+    if not owner:
+        with cache.lock:
+            cache.stats["coalesced"] += 1
+        return future.result()
+
+    try:
+        # Another caller may have finished between the lookup and registering.
+        result = cache.get(key)
+        if result is None:
+            result = _create(content, model)
+            cache.put(key, model, result)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _in_flight.pop(key, None)
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for requests and tokens per minute. Both buckets
+    refill continuously; `acquire` waits until a request of the given size fits.
+    """
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_budget = float(rpm)
+        self.token_budget = float(tpm)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.request_budget = min(self.rpm, self.request_budget + elapsed * self.rpm / 60)
+        self.token_budget = min(self.tpm, self.token_budget + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens):
+        # A single request larger than the whole bucket may go once the bucket is full.
+        tokens = min(tokens, self.tpm)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.request_budget >= 1 and self.token_budget >= tokens:
+                    self.request_budget -= 1
+                    self.token_budget -= tokens
+                    return
+                wait = max(
+                    (1 - self.request_budget) * 60 / self.rpm,
+                    (tokens - self.token_budget) * 60 / self.tpm,
+                )
+                await asyncio.sleep(wait)
+
+
+_rate_limiter = None
+_async_in_flight = {}
+
+
+def get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    return _rate_limiter
+
+
+def estimate_tokens(content):
+    """
+    Tokens a request will consume: the text parts, attached page images and the expected completion.
+    """
+    text_tokens = sum(count_tokens(part["text"]) for part in content if part.get("type") == "text")
+    return text_tokens + content_image_tokens(content) + expected_output_tokens
+
+
+def _retry_delay(error, attempt):
+    """
+    Seconds to wait before the next attempt, or None if the error is not retryable.
+    """
+    from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+    if isinstance(error, APIStatusError) and not isinstance(error, RateLimitError) \
+            and error.status_code < 500:
+        return None
+    if not isinstance(error, (APIStatusError, APIConnectionError, APITimeoutError)):
+        return None
+    retry_after = None
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            retry_after = None
+    backoff = min(60.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+    return max(backoff, retry_after or 0)
+
+
+async def stream_message(content, model="gpt-4o"):
+    """
+    Stream the completion for a prompt array, yielding text deltas as they arrive.
+    Rate limited and retried like `send_message_async`; retries only happen
+    before the first delta has been yielded.
+    """
+    limiter = get_rate_limiter()
+    tokens = estimate_tokens(content)
+    # Page images are rendered off the event loop, once for all attempts.
+    messages = [{"role": "user", "content": await asyncio.to_thread(serialize_content, content)}]
+    for attempt in range(max_attempts):
+        await limiter.acquire(tokens)
+        started = False
+        try:
+            stream = await get_async_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+            )
+            async for event in stream:
+                if event.choices and event.choices[0].delta.content:
+                    started = True
+                    yield event.choices[0].delta.content
+            return
+        except Exception as e:
+            delay = None if started or attempt == max_attempts - 1 else _retry_delay(e, attempt)
+            if delay is None:
+                raise
+            print(f"OpenAI request failed ({e}), retrying in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+
+
+async def _create_async(content, model, on_delta):
+    with span("llm") as llm_span:
+        if on_delta is None:
+            response = await _complete_async(content, model)
+            llm_span["tokens"] = _used_tokens(response, content)
+            return response.choices[0].message.content
+
+        parts = []
+        async for delta in stream_message(content, model):
+            parts.append(delta)
+            result = on_delta(delta)
+            if asyncio.iscoroutine(result):
+                await result
+        # Streamed responses carry no usage; count what was sent and received.
+        text = "".join(parts)
+        llm_span["tokens"] = estimate_tokens(content) - expected_output_tokens + count_tokens(text)
+        return text
+
+
+async def _complete_async(content, model):
+    """
+    One non-streamed completion, rate limited and retried.
+    :return: The API response.
+    """
+    limiter = get_rate_limiter()
+    tokens = estimate_tokens(content)
+    messages = [{"role": "user", "content": await asyncio.to_thread(serialize_content, content)}]
+    for attempt in range(max_attempts):
+        await limiter.acquire(tokens)
+        try:
+            response = await get_async_client().chat.completions.create(
+                model=model,
+                messages=messages,
+            )
+            return response
+        except Exception as e:
+            delay = None if attempt == max_attempts - 1 else _retry_delay(e, attempt)
+            if delay is None:
+                raise
+            print(f"OpenAI request failed ({e}), retrying in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+
+
+async def send_message_async(content, model="gpt-4o", use_cache=True, on_delta=None):
+    """
+    Async counterpart of `send_message` for the asyncio pipeline.
+    Requests go through the shared token-bucket limiter and are retried with
+    jittered exponential backoff on 429, 5xx and connection errors.
+    :param on_delta: Optional callback (plain or async) receiving text deltas as
+        they stream in; cache hits and coalesced requests do not stream.
+    """
+    if not use_cache:
+        return await _create_async(content, model, on_delta)
+
+    cache = get_response_cache()
+    key = cache_key(content, model)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    future = _async_in_flight.get(key)
+    if future is not None:
+        with cache.lock:
+            cache.stats["coalesced"] += 1
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    _async_in_flight[key] = future
+    try:
+        result = await _create_async(content, model, on_delta)
+        cache.put(key, model, result)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Waiters re-raise it; don't warn about it being unretrieved here.
+        future.exception()
+        raise
+    finally:
+        _async_in_flight.pop(key, None)
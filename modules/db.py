@@ -0,0 +1,694 @@
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+
+
+db_params = {
+    "dbname": os.getenv('NEON_DB_NAME'),
+    "user": os.getenv('NEON_USER'),
+    "password": os.getenv('NEON_PASSWORD'),
+    "host": os.getenv('NEON_HOST'),
+    "port": os.getenv('NEON_PORT'),
+    # Only for a local Postgres (e.g. the benchmarks); Neon requires SSL.
+    "sslmode": os.getenv('NEON_SSLMODE', 'require'),
+}
+
+# Set to e.g. `sqlite:///local.db` to run against a local SQLite stand-in instead of Neon.
+database_url = os.getenv('DATABASE_URL', '')
+
+pool_min_size = int(os.getenv('DB_POOL_MIN', '1'))
+pool_max_size = int(os.getenv('DB_POOL_MAX', '10'))
+
+# Named statements used by the pipeline. Written with %s placeholders and
+# translated for each driver, so there is a single source of truth.
+QUERIES = {
+    "select_transcript": """
+        SELECT id, filename FROM transcripts
+        WHERE ticker = %s AND year = %s AND quarter = %s;
+    """,
+    "insert_transcript": """
+        INSERT INTO transcripts (ticker, year, quarter, created_at, filename, content_hash)
+        VALUES (%s, %s, %s, CURRENT_TIMESTAMP, %s, %s) RETURNING id;
+    """,
+    "select_summary_id": """
+        SELECT MAX(id) FROM summaries
+        WHERE ticker = %s AND year = %s AND quarter = %s;
+    """,
+    # Serializes check-then-insert of one key across workers until the transaction ends.
+    # The parameter names the key, e.g. 'transcript:AAPL:2024:3'.
+    "lock_key": """
+        SELECT pg_advisory_xact_lock(hashtext(%s::text));
+    """,
+    "insert_summary": """
+        INSERT INTO summaries (ticker, year, quarter, filename, content_hash, prompt_version)
+        VALUES (%s, %s, %s, %s, %s, %s) RETURNING id;
+    """,
+    # An already stored object with the given content hash, to reuse instead of uploading.
+    "select_object_by_hash": """
+        SELECT filename FROM transcripts WHERE content_hash = %s
+        UNION ALL
+        SELECT filename FROM summaries WHERE content_hash = %s
+        LIMIT 1;
+    """,
+    "insert_summary_source": """
+        INSERT INTO summary_sources (summary_id, source_type, source_id, source_hash)
+        VALUES (%s, %s, %s, %s);
+    """,
+    # Latest summary of every key with its stamps and current source transcript (see `rebuild_summaries`).
+    "latest_summaries": """
+        SELECT s.id, s.ticker, s.year, s.quarter, s.prompt_version, ss.source_hash,
+               t.id, t.filename, t.content_hash
+        FROM summaries s
+        JOIN summary_sources ss ON ss.summary_id = s.id AND ss.source_type = 'transcript'
+        JOIN transcripts t ON t.id = ss.source_id
+        WHERE s.id = (
+            SELECT MAX(latest.id) FROM summaries latest
+            WHERE latest.ticker = s.ticker AND latest.year = s.year AND latest.quarter = s.quarter
+        )
+        ORDER BY s.year DESC, s.quarter DESC, s.ticker;
+    """,
+    "update_transcript": """
+        UPDATE transcripts SET filename = %s, content_hash = %s WHERE id = %s;
+    """,
+    "update_summary": """
+        UPDATE summaries
+        SET filename = %s, content_hash = %s, prompt_version = %s, created_at = CURRENT_TIMESTAMP
+        WHERE id = %s;
+    """,
+    "update_summary_source": """
+        UPDATE summary_sources SET source_hash = %s
+        WHERE summary_id = %s AND source_type = 'transcript' AND source_id = %s;
+    """,
+    # Resolve a whole day of (ticker, year, quarter) keys in one round trip.
+    # Parameters are three parallel arrays: tickers, years, quarters.
+    "plan_lookup": """
+        SELECT w.ticker, w.year, w.quarter, s.filename, t.id, t.filename
+        FROM unnest(%s::text[], %s::int[], %s::int[]) AS w(ticker, year, quarter)
+        LEFT JOIN summaries s
+            ON s.ticker = w.ticker AND s.year = w.year AND s.quarter = w.quarter
+        LEFT JOIN transcripts t
+            ON t.ticker = w.ticker AND t.year = w.year AND t.quarter = w.quarter;
+    """,
+    # Transcript availability jobs (see modules/poller.py). Times are epoch seconds.
+    "add_jobs": """
+        INSERT INTO transcript_jobs (ticker, year, quarter, status, attempts, next_poll_at, created_at)
+        SELECT w.ticker, w.year, w.quarter, 'pending', 0, %s::double precision, %s::double precision
+        FROM unnest(%s::text[], %s::int[], %s::int[]) AS w(ticker, year, quarter)
+        ON CONFLICT (ticker, year, quarter) DO NOTHING;
+    """,
+    # Lease due pending jobs to a worker. Rows locked by a concurrent claim are
+    # skipped rather than waited for; expired leases (crashed workers) are taken over.
+    # Parameters: owner, lease expiry, now, now, limit.
+    "claim_jobs": """
+        UPDATE transcript_jobs
+        SET lease_owner = %s, lease_expires_at = %s, updated_at = %s
+        WHERE (ticker, year, quarter) IN (
+            SELECT ticker, year, quarter FROM transcript_jobs
+            WHERE status = 'pending' AND next_poll_at <= %s
+              AND (lease_expires_at IS NULL OR lease_expires_at < %s)
+            ORDER BY next_poll_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING ticker, year, quarter, attempts, created_at;
+    """,
+    # Heartbeat: extend every lease still held by the worker.
+    "renew_leases": """
+        UPDATE transcript_jobs SET lease_expires_at = %s
+        WHERE lease_owner = %s AND status = 'pending';
+    """,
+    # Finish a job and release its lease, unless another worker took it over meanwhile.
+    "update_job": """
+        UPDATE transcript_jobs
+        SET status = %s, attempts = %s, next_poll_at = %s, updated_at = %s,
+            lease_owner = NULL, lease_expires_at = NULL
+        WHERE ticker = %s AND year = %s AND quarter = %s AND lease_owner = %s;
+    """,
+}
+
+# SQLite has no arrays; the same statements take JSON-encoded lists instead.
+# It has no row or advisory locks either, only one write lock per database.
+SQLITE_QUERIES = {
+    # Python's sqlite3 only opens a transaction at the first write, so the check
+    # before an insert would run outside it. A write matching no row opens it
+    # here, as BEGIN IMMEDIATE (see `_connect`), which takes the write lock
+    # until commit and so serializes the check-then-insert across processes.
+    "lock_key": """
+        DELETE FROM transcripts WHERE filename = %s AND 0;
+    """,
+    "claim_jobs": """
+        UPDATE transcript_jobs
+        SET lease_owner = %s, lease_expires_at = %s, updated_at = %s
+        WHERE (ticker, year, quarter) IN (
+            SELECT ticker, year, quarter FROM transcript_jobs
+            WHERE status = 'pending' AND next_poll_at <= %s
+              AND (lease_expires_at IS NULL OR lease_expires_at < %s)
+            ORDER BY next_poll_at
+            LIMIT %s
+        )
+        RETURNING ticker, year, quarter, attempts, created_at;
+    """,
+    "add_jobs": """
+        INSERT INTO transcript_jobs (ticker, year, quarter, status, attempts, next_poll_at, created_at)
+        SELECT tk.value, yr.value, qt.value, 'pending', 0, %s, %s
+        FROM json_each(%s) tk
+        JOIN json_each(%s) yr ON yr.key = tk.key
+        JOIN json_each(%s) qt ON qt.key = tk.key
+        WHERE true
+        ON CONFLICT (ticker, year, quarter) DO NOTHING;
+    """,
+    "plan_lookup": """
+        WITH w AS (
+            SELECT tk.value AS ticker, yr.value AS year, qt.value AS quarter
+            FROM json_each(%s) tk
+            JOIN json_each(%s) yr ON yr.key = tk.key
+            JOIN json_each(%s) qt ON qt.key = tk.key
+        )
+        SELECT w.ticker, w.year, w.quarter, s.filename, t.id, t.filename
+        FROM w
+        LEFT JOIN summaries s
+            ON s.ticker = w.ticker AND s.year = w.year AND s.quarter = w.quarter
+        LEFT JOIN transcripts t
+            ON t.ticker = w.ticker AND t.year = w.year AND t.quarter = w.quarter;
+    """,
+}
+
+# Tables and indexes the pipeline relies on. Only applied explicitly via
+# `init_schema` (`main.py --init-schema`); safe to re-run.
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS transcripts (
+        id {serial} PRIMARY KEY,
+        ticker TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        quarter INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        filename TEXT NOT NULL,
+        content_hash TEXT
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS summaries (
+        id {serial} PRIMARY KEY,
+        ticker TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        quarter INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        filename TEXT NOT NULL,
+        content_hash TEXT,
+        prompt_version TEXT
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS summary_sources (
+        summary_id INTEGER NOT NULL,
+        source_type TEXT NOT NULL,
+        source_id INTEGER NOT NULL,
+        source_hash TEXT
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS transcript_jobs (
+        ticker TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        quarter INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_poll_at DOUBLE PRECISION NOT NULL,
+        created_at DOUBLE PRECISION NOT NULL,
+        updated_at DOUBLE PRECISION,
+        lease_owner TEXT,
+        lease_expires_at DOUBLE PRECISION,
+        PRIMARY KEY (ticker, year, quarter)
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS transcript_jobs_due_idx ON transcript_jobs (status, next_poll_at);",
+    # Every lookup filters on the full (ticker, year, quarter) key.
+    "CREATE INDEX IF NOT EXISTS transcripts_ticker_year_quarter_idx ON transcripts (ticker, year, quarter);",
+    "CREATE INDEX IF NOT EXISTS summaries_ticker_year_quarter_idx ON summaries (ticker, year, quarter);",
+]
+
+# Columns added after the tables were first created, as (table, column, type).
+# `init_schema` adds the missing ones to existing tables before creating `COLUMN_INDEXES`.
+ADDED_COLUMNS = [
+    ("transcripts", "content_hash", "TEXT"),
+    ("summaries", "content_hash", "TEXT"),
+    ("summaries", "prompt_version", "TEXT"),
+    ("summary_sources", "source_hash", "TEXT"),
+    ("transcript_jobs", "lease_owner", "TEXT"),
+    ("transcript_jobs", "lease_expires_at", "DOUBLE PRECISION"),
+]
+
+COLUMN_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS transcripts_content_hash_idx ON transcripts (content_hash);",
+    "CREATE INDEX IF NOT EXISTS summaries_content_hash_idx ON summaries (content_hash);",
+    "CREATE INDEX IF NOT EXISTS summary_sources_summary_idx ON summary_sources (summary_id);",
+]
+
+
+def is_sqlite(url=None):
+    url = database_url if url is None else url
+    return url.startswith("sqlite:")
+
+
+def _sqlite_path(url):
+    return url.split("sqlite:///", 1)[-1] or ":memory:"
+
+
+def _to_qmark(sql):
+    return sql.replace("%s", "?")
+
+
+def _sqlite_statement(name, params):
+    sql = _to_qmark(SQLITE_QUERIES.get(name, QUERIES[name]))
+    params = tuple(json.dumps(p) if isinstance(p, (list, tuple)) else p for p in params)
+    return sql, params
+
+
+def _to_dollar(sql):
+    """
+    Translate %s placeholders into the numbered $n style used by PREPARE and asyncpg.
+    """
+    counter = iter(range(1, sql.count("%s") + 1))
+    return re.sub(r"%s", lambda _: f"${next(counter)}", sql)
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections_created = 0
+        self.acquisitions = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.queries = 0
+        self.errors = 0
+
+    def acquired(self, waited):
+        with self.lock:
+            self.acquisitions += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            if waited > 0.001:
+                self.waits += 1
+            self.wait_time += waited
+
+    def released(self):
+        with self.lock:
+            self.in_use -= 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "connections_created": self.connections_created,
+                "acquisitions": self.acquisitions,
+                "waits": self.waits,
+                "wait_time_seconds": round(self.wait_time, 6),
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "queries": self.queries,
+                "errors": self.errors,
+            }
+
+
+class Session:
+    """
+    A pooled connection checked out for one unit of work.
+    Statements are referred to by their name in `QUERIES`.
+    """
+    def __init__(self, pool, connection):
+        self.pool = pool
+        self.connection = connection
+
+    def _execute(self, name, params):
+        cursor = self.connection.cursor()
+        with self.pool.metrics.lock:
+            self.pool.metrics.queries += 1
+        if self.pool.sqlite:
+            cursor.execute(*_sqlite_statement(name, params))
+        elif self.pool.prepare:
+            self._prepare(cursor, name)
+            placeholders = ", ".join(["%s"] * len(params))
+            cursor.execute(f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}", params)
+        else:
+            cursor.execute(QUERIES[name], params)
+        return cursor
+
+    def _prepare(self, cursor, name):
+        prepared = self.pool.prepared.setdefault(id(self.connection), set())
+        if name not in prepared:
+            cursor.execute(f"PREPARE {name} AS {_to_dollar(QUERIES[name]).strip().rstrip(';')}")
+            prepared.add(name)
+
+    def execute(self, name, *params):
+        self._execute(name, params).close()
+
+    def fetchone(self, name, *params):
+        cursor = self._execute(name, params)
+        row = cursor.fetchone()
+        cursor.close()
+        return row
+
+    def fetchall(self, name, *params):
+        cursor = self._execute(name, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+    def commit(self):
+        self.connection.commit()
+
+
+class ConnectionPool:
+    """
+    Thread-safe connection pool shared by every synchronous DB touchpoint.
+    Connections are opened lazily up to `maxconn` and callers block when the
+    pool is exhausted instead of failing.
+    """
+    def __init__(self, minconn=None, maxconn=None, url=None, prepare=True):
+        """
+        :param minconn: Connections opened eagerly.
+        :param maxconn: Upper bound on open connections.
+        :param url: `sqlite:///path` for the local stand-in; Neon settings are used otherwise.
+        :param prepare: Use server-side prepared statements on Postgres.
+        """
+        self.url = database_url if url is None else url
+        self.sqlite = is_sqlite(self.url)
+        self.prepare = prepare
+        self.maxconn = maxconn or pool_max_size
+        self.metrics = PoolMetrics()
+        self.prepared = {}
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.maxconn)
+        self.closed = False
+        for _ in range(min(minconn or pool_min_size, self.maxconn)):
+            self.idle.append(self._connect())
+
+    def _connect(self):
+        if self.sqlite:
+            connection = sqlite3.connect(_sqlite_path(self.url), timeout=30, check_same_thread=False,
+                                         isolation_level="IMMEDIATE")
+            # Readers must not block the writers of concurrent tickers.
+            connection.execute("PRAGMA journal_mode=WAL;")
+        else:
+            import psycopg2
+            connection = psycopg2.connect(**db_params)
+        with self.metrics.lock:
+            self.metrics.connections_created += 1
+        return connection
+
+    def _acquire(self):
+        started = time.perf_counter()
+        self.slots.acquire()
+        with self.lock:
+            connection = self.idle.pop() if self.idle else None
+        if connection is None:
+            try:
+                connection = self._connect()
+            except Exception:
+                self.slots.release()
+                raise
+        self.metrics.acquired(time.perf_counter() - started)
+        return connection
+
+    def _release(self, connection, broken=False):
+        self.metrics.released()
+        with self.lock:
+            if broken or self.closed:
+                self.prepared.pop(id(connection), None)
+                connection.close()
+            else:
+                self.idle.append(connection)
+        self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for one transaction; commits on success and rolls back on error.
+        """
+        connection = self._acquire()
+        broken = False
+        try:
+            yield Session(self, connection)
+            connection.commit()
+        except Exception:
+            with self.metrics.lock:
+                self.metrics.errors += 1
+            # Drop the connection rather than guess which prepared statements survived the rollback.
+            broken = True
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            self._release(connection, broken)
+
+    def execute(self, name, *params):
+        with self.connection() as session:
+            session.execute(name, *params)
+
+    def fetchone(self, name, *params):
+        with self.connection() as session:
+            return session.fetchone(name, *params)
+
+    def fetchall(self, name, *params):
+        with self.connection() as session:
+            return session.fetchall(name, *params)
+
+    def init_schema(self):
+        serial = "INTEGER" if self.sqlite else "SERIAL"
+        with self.connection() as session:
+            cursor = session.connection.cursor()
+            for statement in SCHEMA:
+                cursor.execute(statement.format(serial=serial))
+            for table, column, column_type in ADDED_COLUMNS:
+                if self.sqlite:
+                    cursor.execute(f"PRAGMA table_info({table});")
+                    if column in (row[1] for row in cursor.fetchall()):
+                        continue
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type};")
+                else:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type};")
+            for statement in COLUMN_INDEXES:
+                cursor.execute(statement)
+            cursor.close()
+
+    def get_metrics(self):
+        metrics = self.metrics.snapshot()
+        with self.lock:
+            metrics["idle"] = len(self.idle)
+        metrics["max_size"] = self.maxconn
+        return metrics
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+        self.prepared.clear()
+
+
+class AsyncSession:
+    def __init__(self, pool, connection):
+        self.pool = pool
+        self.connection = connection
+
+    async def execute(self, name, *params):
+        self.pool.metrics.queries += 1
+        await self.connection.execute(_to_dollar(QUERIES[name]), *params)
+
+    async def fetchone(self, name, *params):
+        self.pool.metrics.queries += 1
+        return await self.connection.fetchrow(_to_dollar(QUERIES[name]), *params)
+
+    async def fetchall(self, name, *params):
+        self.pool.metrics.queries += 1
+        return await self.connection.fetch(_to_dollar(QUERIES[name]), *params)
+
+
+class AsyncConnectionPool:
+    """
+    asyncpg-backed pool for the asyncio pipeline. asyncpg prepares and caches
+    every statement per connection, so named queries are parsed once.
+    Without asyncpg (or for the SQLite stand-in) it delegates to the shared
+    synchronous pool through a worker thread, keeping the same interface.
+    """
+    def __init__(self, minconn=None, maxconn=None, url=None):
+        self.url = database_url if url is None else url
+        self.minconn = minconn or pool_min_size
+        self.maxconn = maxconn or pool_max_size
+        self.metrics = PoolMetrics()
+        self.sqlite = is_sqlite(self.url)
+        self.pool = None
+        self.sync_pool = None
+
+    async def open(self):
+        asyncpg = None
+        if not self.sqlite:
+            try:
+                import asyncpg
+            except ImportError:
+                asyncpg = None
+
+        if asyncpg is None:
+            self.sync_pool = get_pool()
+            return self
+
+        async def count_connection(connection):
+            self.metrics.connections_created += 1
+
+        self.pool = await asyncpg.create_pool(
+            database=db_params["dbname"],
+            user=db_params["user"],
+            password=db_params["password"],
+            host=db_params["host"],
+            port=db_params["port"],
+            ssl=db_params["sslmode"],
+            min_size=self.minconn,
+            max_size=self.maxconn,
+            init=count_connection,
+        )
+        return self
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Check out a connection for one transaction.
+        """
+        if self.sync_pool is not None:
+            # Run the whole transaction on one sync connection, statement by statement, on a
+            # thread of its own: on the shared executor, other tickers' statements blocked on
+            # SQLite's write lock could take every thread and keep this transaction from committing.
+            loop = asyncio.get_running_loop()
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-transaction")
+            context = self.sync_pool.connection()
+            try:
+                session = await loop.run_in_executor(executor, context.__enter__)
+                try:
+                    yield _ThreadedSession(session, executor)
+                except BaseException as e:
+                    await loop.run_in_executor(executor, context.__exit__, type(e), e, e.__traceback__)
+                    raise
+                await loop.run_in_executor(executor, context.__exit__, None, None, None)
+            finally:
+                executor.shutdown(wait=False)
+            return
+
+        started = time.perf_counter()
+        async with self.pool.acquire() as connection:
+            self.metrics.acquired(time.perf_counter() - started)
+            try:
+                async with connection.transaction():
+                    yield AsyncSession(self, connection)
+            except Exception:
+                self.metrics.errors += 1
+                raise
+            finally:
+                self.metrics.released()
+
+    async def execute(self, name, *params):
+        async with self.connection() as session:
+            await session.execute(name, *params)
+
+    async def fetchone(self, name, *params):
+        async with self.connection() as session:
+            return await session.fetchone(name, *params)
+
+    async def fetchall(self, name, *params):
+        async with self.connection() as session:
+            return await session.fetchall(name, *params)
+
+    def get_metrics(self):
+        if self.sync_pool is not None:
+            return self.sync_pool.get_metrics()
+        metrics = self.metrics.snapshot()
+        metrics["idle"] = self.pool.get_idle_size()
+        metrics["max_size"] = self.maxconn
+        return metrics
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+
+class _ThreadedSession:
+    """
+    Async facade over a checked-out sync `Session`.
+    """
+    def __init__(self, session, executor):
+        self.session = session
+        self.executor = executor
+
+    def _run(self, method, name, params):
+        return asyncio.get_running_loop().run_in_executor(self.executor, method, name, *params)
+
+    async def execute(self, name, *params):
+        await self._run(self.session.execute, name, params)
+
+    async def fetchone(self, name, *params):
+        return await self._run(self.session.fetchone, name, params)
+
+    async def fetchall(self, name, *params):
+        return await self._run(self.session.fetchall, name, params)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_async_pool = None
+
+
+def get_pool():
+    """
+    Return the process-wide synchronous pool, creating it on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+
+async def get_async_pool():
+    """
+    Return the async pool bound to the running event loop, creating it on first use.
+    """
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = await AsyncConnectionPool().open()
+    return _async_pool
+
+
+async def close_pools():
+    global _pool, _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def get_metrics():
+    """
+    Metrics for every pool that has been opened in this process.
+    """
+    metrics = {}
+    if _pool is not None:
+        metrics["sync"] = _pool.get_metrics()
+    if _async_pool is not None and _async_pool.pool is not None:
+        metrics["async"] = _async_pool.get_metrics()
+    return metrics
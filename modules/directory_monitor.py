@@ -1,76 +1,146 @@
-import time
-import threading
+import os
+import asyncio
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 
 class DirectoryMonitor:
-    def __init__(self, base_directory, callback, debounce_time=2.0):
+    def __init__(self, base_directory, callback=None, debounce_time=2.0, stable_time=1.0, max_queued_batches=4):
         """
         Initialize the monitor for a specific base directory.
         :param base_directory: The base directory to monitor.
-        :param callback: Function to call with the list of new files.
-        :param debounce_time: Time (in seconds) to wait before calling the callback.
+        :param callback: Function to call with the list of new files when using `start`.
+        :param debounce_time: Time (in seconds) without new events before a batch is formed.
+        :param stable_time: A file is only handed out once its size and modification
+            time stayed the same for this long, so half-written files are not picked up.
+            0 hands files out as soon as the directory is quiet.
+        :param max_queued_batches: Batches waiting for the consumer; once full, new
+            files keep accumulating in the next batch until the consumer catches up.
         """
         self.base_directory = base_directory
         self.callback = callback
         self.debounce_time = debounce_time
-        self.observer = Observer()
-        self.new_files = set()
-        self.lock = threading.Lock()
-        self.timer = None
+        self.stable_time = stable_time
+        self.max_queued_batches = max_queued_batches
+        self.observer = None
+        self.loop = None
+        self.pending = {}  # path -> (size, mtime) when last checked, None if not checked yet
+        self.last_event = 0.0
+        self.changed = None
+        self.queue = None
+        self.debounce_task = None
 
     def start(self):
         """
-        Start monitoring the directory.
+        Monitor the directory and call the callback with every batch until interrupted.
         """
-        event_handler = NewFileHandler(self.new_file_detected)
-        self.observer.schedule(event_handler, self.base_directory, recursive=True)
-        self.observer.start()
-        print(f"Started monitoring {self.base_directory}")
         try:
-            while True:
-                time.sleep(1)
+            asyncio.run(self._run_callback())
         except KeyboardInterrupt:
+            pass
+
+    async def _run_callback(self):
+        async for files in self.batches():
+            self.callback(files)
+
+    async def batches(self):
+        """
+        Asynchronously iterate over batches of new or changed files:
+        `async for files in monitor.batches(): ...`.
+        The observer is stopped when the iteration ends.
+        """
+        self._start_observer()
+        try:
+            while True:
+                yield await self.queue.get()
+        finally:
             self.stop()
 
+    def _start_observer(self):
+        self.loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+        self.queue = asyncio.Queue(maxsize=max(1, self.max_queued_batches))
+        self.debounce_task = asyncio.create_task(self._debounce())
+        self.observer = Observer()
+        self.observer.schedule(FileEventHandler(self), self.base_directory, recursive=True)
+        self.observer.start()
+        print(f"Started monitoring {self.base_directory}")
+
     def stop(self):
         """
         Stop monitoring the directory.
         """
-        self.observer.stop()
-        self.observer.join()
-        print("Stopped monitoring")
+        if self.debounce_task is not None:
+            self.debounce_task.cancel()
+            self.debounce_task = None
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+            print("Stopped monitoring")
 
-    def new_file_detected(self, file_path):
+    def file_changed(self, file_path, moved_from=None):
         """
-        Called when a new file is detected. Debounces the processing.
-        :param file_path: Path of the new file.
+        Called from the observer thread for every created, modified or moved-in file.
+        :param file_path: Path of the file.
+        :param moved_from: Previous path when the file was renamed into place.
         """
-        with self.lock:
-            self.new_files.add(file_path)
-            if self.timer:
-                self.timer.cancel()
-            self.timer = threading.Timer(self.debounce_time, self.process_new_files)
-            self.timer.start()
+        self.loop.call_soon_threadsafe(self._record, file_path, moved_from)
 
-    def process_new_files(self):
+    def _record(self, file_path, moved_from):
+        if moved_from is not None:
+            self.pending.pop(moved_from, None)
+        self.pending[file_path] = None
+        self.last_event = self.loop.time()
+        self.changed.set()
+
+    async def _debounce(self):
         """
-        Collects the batched new files and calls the callback.
+        Single task forming batches: waits for the directory to be quiet, then
+        hands out the files whose size has settled. Files still being written
+        are checked again after `stable_time`.
         """
-        with self.lock:
-            files_to_process = list(self.new_files)
-            self.new_files.clear()
-        self.callback(files_to_process)
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+            while (delay := self.last_event + self.debounce_time - self.loop.time()) > 0:
+                await asyncio.sleep(delay)
 
+            ready = self._collect_stable()
+            if ready:
+                # Blocks while the consumer is behind.
+                await self.queue.put(ready)
+            if self.pending:
+                await asyncio.sleep(self.stable_time)
+                self.changed.set()
 
-class NewFileHandler(FileSystemEventHandler):
-    def __init__(self, callback):
+    def _collect_stable(self):
+        """
+        :return: Sorted list of pending files that did not change since the last check.
+        """
+        ready = []
+        for file_path, previous in list(self.pending.items()):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                del self.pending[file_path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current == previous or self.stable_time <= 0:
+                ready.append(file_path)
+                del self.pending[file_path]
+            else:
+                self.pending[file_path] = current
+        return sorted(ready)
+
+
+class FileEventHandler(FileSystemEventHandler):
+    def __init__(self, monitor):
         """
         Initialize the file event handler.
-        :param callback: Callback function to call on file creation.
+        :param monitor: The `DirectoryMonitor` to notify.
         """
-        self.callback = callback
+        self.monitor = monitor
 
     def on_created(self, event):
         """
@@ -78,4 +148,18 @@ class NewFileHandler(FileSystemEventHandler):
         :param event: The event object containing information about the change.
         """
         if not event.is_directory:
-            self.callback(event.src_path)
+            self.monitor.file_changed(event.src_path)
+
+    def on_modified(self, event):
+        """
+        Called when a file is written to; postpones the batch until writing stops.
+        """
+        if not event.is_directory:
+            self.monitor.file_changed(event.src_path)
+
+    def on_moved(self, event):
+        """
+        Called when a file is renamed, e.g. a temporary file moved into place by an atomic write.
+        """
+        if not event.is_directory:
+            self.monitor.file_changed(event.dest_path, moved_from=event.src_path)
@@ -0,0 +1,144 @@
+import os
+import time
+import importlib.util
+from datetime import datetime, timedelta
+
+
+calendar_cache_dir = os.getenv('CALENDAR_CACHE_DIR', os.path.join('.cache', 'calendar'))
+# Calendars for recent days still change (late reporters, corrections); older ones are final.
+calendar_ttl = float(os.getenv('CALENDAR_CACHE_TTL_HOURS', '6')) * 3600
+calendar_final_after = timedelta(days=int(os.getenv('CALENDAR_FINAL_AFTER_DAYS', '3')))
+
+MONTH_TO_QUARTER = {
+    'Jan': 1, 'Feb': 1, 'Mar': 1,
+    'Apr': 2, 'May': 2, 'Jun': 2,
+    'Jul': 3, 'Aug': 3, 'Sep': 3,
+    'Oct': 4, 'Nov': 4, 'Dec': 4,
+}
+
+# pandas (and pyarrow, the Parquet engine) are only imported once a calendar is needed.
+_cache_format = "parquet" if importlib.util.find_spec("pyarrow") else "pickle"
+
+
+def _cache_path(target_date):
+    return os.path.join(calendar_cache_dir, f"{target_date:%Y-%m-%d}.{_cache_format}")
+
+
+def _is_fresh(path, target_date):
+    if not os.path.exists(path):
+        return False
+    if datetime.now() - target_date >= calendar_final_after:
+        return True
+    return time.time() - os.path.getmtime(path) < calendar_ttl
+
+
+def fetch_earnings(target_date):
+    """
+    Fetch a day's earnings calendar from Nasdaq.
+    """
+    from finance_calendars import finance_calendars as fc
+    return fc.get_earnings_by_date(target_date)
+
+
+def load_calendar(target_date, refresh=False):
+    """
+    Earnings calendar for a day, served from the on-disk cache when fresh.
+    :param target_date: Day to fetch (datetime at midnight).
+    :param refresh: Ignore the cache and fetch again.
+    :return: DataFrame indexed by symbol, as returned by `fetch_earnings`.
+    """
+    import pandas as pd
+    path = _cache_path(target_date)
+    if not refresh and _is_fresh(path, target_date):
+        try:
+            if _cache_format == "parquet":
+                return pd.read_parquet(path)
+            return pd.read_pickle(path)
+        except Exception as e:
+            print(f"Ignoring unreadable calendar cache {path}: {e}")
+
+    earnings = fetch_earnings(target_date)
+    os.makedirs(calendar_cache_dir, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    if _cache_format == "parquet":
+        earnings.to_parquet(temp_path)
+    else:
+        earnings.to_pickle(temp_path)
+    os.replace(temp_path, path)
+    return earnings
+
+
+def parse_fiscal_quarters(earnings):
+    """
+    Derive fiscal year and quarter for every row from `fiscalQuarterEnding`
+    (e.g. 'Sep/2024') in one vectorized pass.
+    :return: Tuple of a DataFrame with `fiscal_year` and `fiscal_quarter`
+        columns for the parseable rows, and the Series of values that could not be parsed.
+    """
+    import pandas as pd
+    if earnings.empty or 'fiscalQuarterEnding' not in earnings.columns:
+        empty = pd.DataFrame({'fiscal_year': [], 'fiscal_quarter': []}, dtype=int)
+        return empty, pd.Series(dtype=object)
+
+    raw = earnings['fiscalQuarterEnding']
+    parts = raw.astype(str).str.extract(r'^\s*([A-Za-z]{3})[A-Za-z]*/(\d{4})\s*$')
+    quarters = parts[0].str.title().map(MONTH_TO_QUARTER)
+    valid = quarters.notna() & parts[1].notna()
+
+    parsed = pd.DataFrame({
+        'fiscal_year': parts.loc[valid, 1].astype(int),
+        'fiscal_quarter': quarters[valid].astype(int),
+    }, index=earnings.index[valid])
+    return parsed, raw[~valid]
+
+
+def parse_number(column):
+    """
+    Parse Nasdaq calendar figures such as '$3,012,345,678', '($0.12)' or 'N/A'
+    into floats (NaN when missing), vectorized.
+    """
+    import pandas as pd
+    text = column.astype(str).str.strip()
+    negative = text.str.startswith('(') & text.str.endswith(')')
+    numbers = pd.to_numeric(text.str.replace(r'[$,()\s]', '', regex=True), errors='coerce')
+    return numbers.where(~negative, -numbers)
+
+
+def _column(earnings, name):
+    import pandas as pd
+    if name in earnings.columns:
+        return parse_number(earnings[name])
+    return pd.Series(float('nan'), index=earnings.index)
+
+
+def calendar_symbols(earnings):
+    """
+    Turn a calendar frame into the symbol entries used by the pipeline,
+    reporting unparseable rows in one message. Besides the ticker and fiscal
+    period, entries carry `market_cap`, `eps_forecast` and `estimates`
+    (None when the calendar has no figure) for scheduling.
+    """
+    import pandas as pd
+    parsed, invalid = parse_fiscal_quarters(earnings)
+    if len(invalid):
+        examples = ", ".join(f"{symbol}={value!r}" for symbol, value in invalid.head(5).items())
+        print(f"Skipped {len(invalid)} calendar row(s) with unparseable fiscal data: {examples}"
+              f"{', ...' if len(invalid) > 5 else ''}")
+    if parsed.empty:
+        return []
+
+    figures = pd.DataFrame({
+        'market_cap': _column(earnings, 'marketCap'),
+        'eps_forecast': _column(earnings, 'epsForecast'),
+        'estimates': _column(earnings, 'noOfEsts'),
+    }).loc[parsed.index]
+    figures = figures.astype(object).where(figures.notna(), None)
+
+    return [
+        {'ticker': ticker, 'fiscal_year': year, 'fiscal_quarter': quarter,
+         'market_cap': market_cap, 'eps_forecast': eps_forecast, 'estimates': estimates}
+        for ticker, year, quarter, market_cap, eps_forecast, estimates in zip(
+            parsed.index.tolist(), parsed['fiscal_year'].tolist(), parsed['fiscal_quarter'].tolist(),
+            figures['market_cap'].tolist(), figures['eps_forecast'].tolist(), figures['estimates'].tolist(),
+        )
+    ]
@@ -0,0 +1,55 @@
+import os
+from modules.prompt_preparation import PromptPreparation
+
+
+ingest_directory = os.getenv('INGEST_DIR', 'inbox')
+# "text" extracts PDF text; "images" attaches rendered pages for the vision model.
+pdf_mode = os.getenv('INGEST_PDF_MODE', 'text')
+max_pdf_pages = int(os.getenv('INGEST_MAX_PAGES', '60'))
+ingest_workers = int(os.getenv('INGEST_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt")
+
+
+def is_supported(file_path):
+    return file_path.lower().endswith(SUPPORTED_EXTENSIONS) and not os.path.basename(file_path).startswith('.')
+
+
+def document_ticker(file_path, base_directory):
+    """
+    Ticker a dropped file belongs to: its top-level folder inside the drop
+    folder (`inbox/AAPL/deck.pdf`), or else the filename prefix before the
+    first underscore (`inbox/AAPL_Q3_deck.pdf`).
+    """
+    relative = os.path.relpath(file_path, base_directory)
+    parts = relative.split(os.sep)
+    name = parts[0] if len(parts) > 1 else os.path.splitext(parts[0])[0].split('_')[0]
+    return name.upper()
+
+
+def extract_file(file_path, mode=None, max_pages=None):
+    """
+    Extract a file into prompt content parts. Runs in a worker process, so it
+    only takes and returns picklable values.
+    :return: List of content dictionaries, without any instructions.
+    """
+    preparation = PromptPreparation("")
+    preparation.process_file(
+        file_path,
+        pdf_mode=mode or pdf_mode,
+        max_pages=max_pdf_pages if max_pages is None else max_pages,
+    )
+    return preparation.get_prompt_array()[1:]
+
+
+def group_by_ticker(files, base_directory):
+    """
+    :return: Dict of ticker -> sorted list of supported files from a batch.
+    """
+    groups = {}
+    for file_path in sorted(set(files)):
+        if is_supported(file_path) and os.path.isfile(file_path):
+            groups.setdefault(document_ticker(file_path, base_directory), []).append(file_path)
+        else:
+            print(f"Ignoring {file_path}")
+    return groups
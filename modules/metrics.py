@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+
+# Spans kept individually for the run report; stage totals cover every span.
+max_report_spans = int(os.getenv('METRICS_MAX_SPANS', '10000'))
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Ticker being processed by the current task; spans default to it. asyncio
+# tasks and `asyncio.to_thread` copy the context, so it follows the work.
+current_ticker = contextvars.ContextVar("current_ticker", default=None)
+
+
+def _flatten(stats, prefix=""):
+    for key, value in stats.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{name}_")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+    """
+    Timings of the pipeline stages (calendar, db_lookup, transcript_fetch,
+    store_download, store_upload, llm, db_write, publish). Every span records
+    its latency, bytes and tokens, per stage and per ticker. Stats of the
+    shared clients (pools, caches, publish queue) are pulled in through
+    collectors when exporting.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.spans = deque(maxlen=max_report_spans)
+        self.stages = {}
+        self.tickers = {}
+        self.collectors = {}
+
+    def reset(self):
+        """
+        Forget recorded spans, e.g. between benchmark phases. Collectors are kept.
+        """
+        with self.lock:
+            self.started = time.time()
+            self.spans.clear()
+            self.stages.clear()
+            self.tickers.clear()
+
+    def record(self, stage, seconds, ticker=None, bytes=0, tokens=0, error=None):
+        with self.lock:
+            totals = self.stages.get(stage)
+            if totals is None:
+                totals = self.stages[stage] = {
+                    "count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0, "tokens": 0,
+                    "buckets": [0] * len(LATENCY_BUCKETS),
+                }
+            totals["count"] += 1
+            totals["errors"] += error is not None
+            totals["seconds"] += seconds
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+            totals["bytes"] += bytes
+            totals["tokens"] += tokens
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    totals["buckets"][index] += 1
+
+            if ticker is not None:
+                ticker_stages = self.tickers.setdefault(ticker, {})
+                entry = ticker_stages.setdefault(stage, {"count": 0, "seconds": 0.0, "bytes": 0, "tokens": 0})
+                entry["count"] += 1
+                entry["seconds"] += seconds
+                entry["bytes"] += bytes
+                entry["tokens"] += tokens
+
+            self.spans.append({
+                "stage": stage, "ticker": ticker, "started_at": round(time.time() - seconds, 3),
+                "seconds": round(seconds, 6), "bytes": bytes, "tokens": tokens, "error": error,
+            })
+
+    @contextmanager
+    def span(self, stage, ticker=None):
+        """
+        Time a block as one span of `stage`:
+        `with metrics.span("llm") as span: ...; span["tokens"] = n`.
+        The yielded dict takes `bytes` and `tokens`; an exception marks the span as failed.
+        """
+        values = {"bytes": 0, "tokens": 0}
+        error = None
+        started = time.perf_counter()
+        try:
+            yield values
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - started, ticker=ticker or current_ticker.get(),
+                        bytes=values["bytes"], tokens=values["tokens"], error=error)
+
+    def add_collector(self, name, collect):
+        """
+        :param collect: Callable returning a (possibly nested) dict of numbers, e.g. a `get_stats` method.
+        """
+        with self.lock:
+            self.collectors[name] = collect
+
+    def _collect(self):
+        with self.lock:
+            collectors = dict(self.collectors)
+        stats = {}
+        for name, collect in collectors.items():
+            try:
+                stats[name] = collect()
+            except Exception as e:
+                print(f"Failed to collect {name} metrics: {e}")
+        return stats
+
+    def prometheus(self):
+        """
+        :return: All metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            stages = {stage: dict(totals, buckets=list(totals["buckets"])) for stage, totals in self.stages.items()}
+        lines = [
+            "# HELP pipeline_stage_seconds Latency of pipeline stage spans.",
+            "# TYPE pipeline_stage_seconds histogram",
+        ]
+        for stage, totals in sorted(stages.items()):
+            label = f'stage="{_escape(stage)}"'
+            for bound, count in zip(LATENCY_BUCKETS, totals["buckets"]):
+                lines.append(f'pipeline_stage_seconds_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'pipeline_stage_seconds_bucket{{{label},le="+Inf"}} {totals["count"]}')
+            lines.append(f'pipeline_stage_seconds_sum{{{label}}} {totals["seconds"]}')
+            lines.append(f'pipeline_stage_seconds_count{{{label}}} {totals["count"]}')
+        for name, key, help_text in (
+            ("pipeline_stage_errors_total", "errors", "Pipeline stage spans that raised."),
+            ("pipeline_stage_bytes_total", "bytes", "Bytes transferred by pipeline stages."),
+            ("pipeline_stage_tokens_total", "tokens", "OpenAI tokens used by pipeline stages."),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, totals in sorted(stages.items()):
+                lines.append(f'{name}{{stage="{_escape(stage)}"}} {totals[key]}')
+
+        lines.append("# HELP pipeline_stat Client statistics (pools, caches, publish queue, budget).")
+        lines.append("# TYPE pipeline_stat gauge")
+        for source, stats in sorted(self._collect().items()):
+            for key, value in _flatten(stats):
+                lines.append(f'pipeline_stat{{source="{_escape(source)}",name="{_escape(key)}"}} {value}')
+        lines.append(f"pipeline_started_seconds {self.started}")
+        return "\n".join(lines) + "\n"
+
+    def report(self, **extra):
+        """
+        :return: JSON-serializable run report: stage totals, per-ticker stage
+            totals, client stats and the most recent spans.
+        """
+        with self.lock:
+            stages = {
+                stage: {key: value for key, value in totals.items() if key != "buckets"}
+                for stage, totals in self.stages.items()
+            }
+            tickers = json.loads(json.dumps(self.tickers))
+            spans = list(self.spans)
+        for totals in stages.values():
+            totals["mean_seconds"] = totals["seconds"] / totals["count"] if totals["count"] else 0.0
+        return {
+            "started_at": self.started,
+            "elapsed_seconds": round(time.time() - self.started, 3),
+            **extra,
+            "stages": stages,
+            "tickers": tickers,
+            "stats": self._collect(),
+            "spans": spans,
+        }
+
+    def write_report(self, path, **extra):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, indent=2, default=str)
+        os.replace(temp_path, path)
+        print(f"Run report written to {path}")
+
+    def serve(self, port, host="0.0.0.0"):
+        """
+        Serve `/metrics` for Prometheus from a daemon thread.
+        :return: The HTTP server; call `shutdown()` to stop it.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+
+metrics = RunMetrics()
+
+
+def span(stage, ticker=None):
+    """
+    Shortcut for `metrics.span` on the process-wide registry.
+    """
+    return metrics.span(stage, ticker)
@@ -0,0 +1,114 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+
+
+# Delay before re-polling a job: doubles with every attempt, up to the cap.
+poll_backoff = float(os.getenv('POLL_BACKOFF_MINUTES', '10')) * 60
+poll_backoff_cap = float(os.getenv('POLL_BACKOFF_CAP_MINUTES', '360')) * 60
+# Jobs whose transcript has not appeared after this long are given up.
+poll_max_age = float(os.getenv('POLL_MAX_AGE_HOURS', '72')) * 3600
+# A claimed job is handed to another worker if its lease is not renewed for this long.
+lease_seconds = float(os.getenv('JOB_LEASE_SECONDS', '600'))
+
+
+def next_poll_delay(attempts):
+    """
+    Seconds to wait after the given number of unsuccessful attempts.
+    """
+    return min(poll_backoff_cap, poll_backoff * 2 ** max(attempts - 1, 0))
+
+
+def worker_id():
+    """
+    Name identifying this process as a lease owner, unique across hosts.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class TranscriptJobs:
+    """
+    Pending (ticker, year, quarter) jobs kept in the `transcript_jobs` table.
+    A job stays 'pending' until its summary is queued for publishing
+    ('done'), or until it is older than `poll_max_age` ('expired').
+    Workers lease the jobs they work on, so any number of processes and hosts
+    can share the table; a crashed worker's jobs are picked up again once
+    its lease runs out.
+    """
+    def __init__(self, pool, owner=None):
+        """
+        :param pool: The async pool from `modules.db.get_async_pool`.
+        :param owner: Lease owner name; defaults to a new `worker_id`.
+        """
+        self.pool = pool
+        self.owner = owner or worker_id()
+
+    async def add(self, symbols):
+        """
+        Register symbols from the earnings calendar; existing jobs are left untouched.
+        """
+        if not symbols:
+            return
+        now = time.time()
+        await self.pool.execute(
+            "add_jobs", now, now,
+            [symbol['ticker'] for symbol in symbols],
+            [symbol['fiscal_year'] for symbol in symbols],
+            [symbol['fiscal_quarter'] for symbol in symbols],
+        )
+
+    async def claim(self, limit):
+        """
+        Lease up to `limit` pending jobs whose next poll time has passed and
+        that no other worker holds.
+        :return: The claimed jobs, as symbol entries.
+        """
+        now = time.time()
+        rows = await self.pool.fetchall("claim_jobs", self.owner, now + lease_seconds, now, now, now, limit)
+        return [
+            {'ticker': ticker, 'fiscal_year': year, 'fiscal_quarter': quarter,
+             'attempts': attempts, 'created_at': created_at}
+            for ticker, year, quarter, attempts, created_at in rows
+        ]
+
+    async def renew(self):
+        """
+        Extend the leases of every job this worker holds.
+        """
+        await self.pool.execute("renew_leases", time.time() + lease_seconds, self.owner)
+
+    async def keep_alive(self):
+        """
+        Renew the leases every third of `lease_seconds` until cancelled; run it while processing claimed jobs.
+        """
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            try:
+                await self.renew()
+            except Exception as e:
+                print(f"Failed to renew job leases: {e}")
+
+    async def finish(self, jobs, done_keys):
+        """
+        Mark jobs whose key is in `done_keys` as done, reschedule the rest with
+        backoff and release their leases. Jobs another worker took over in the
+        meantime are left to it.
+        :return: Tuple of (done, rescheduled, expired) counts.
+        """
+        now = time.time()
+        counts = {"done": 0, "pending": 0, "expired": 0}
+        async with self.pool.connection() as session:
+            for job in jobs:
+                key = (job['ticker'], job['fiscal_year'], job['fiscal_quarter'])
+                attempts = job['attempts'] + 1
+                if key in done_keys:
+                    status, next_poll_at = "done", now
+                elif now - job['created_at'] >= poll_max_age:
+                    status, next_poll_at = "expired", now
+                else:
+                    status, next_poll_at = "pending", now + next_poll_delay(attempts)
+                counts[status] += 1
+                await session.execute("update_job", status, attempts, next_poll_at, now, *key, self.owner)
+        return counts["done"], counts["pending"], counts["expired"]
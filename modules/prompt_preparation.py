@@ -1,25 +1,340 @@
-# import fitz  # PyMuPDF
+import os
+import re
+import math
 import base64
 from mimetypes import guess_type
 from io import BytesIO
-# from PIL import Image
+
+
+max_chunk_tokens = int(os.getenv('TRANSCRIPT_CHUNK_TOKENS', '8000'))
+
+# Rendered PDF pages are scaled so their longer side is at most this many pixels.
+image_max_side = int(os.getenv('IMAGE_MAX_SIDE', '1024'))
+image_jpeg_quality = int(os.getenv('IMAGE_JPEG_QUALITY', '75'))
+# Vision tokens the images of one prompt may cost; further pages are sent at
+# low detail, and pages that do not fit even then are left out.
+image_token_budget = int(os.getenv('IMAGE_TOKEN_BUDGET', '20000'))
+LOW_DETAIL_MAX_SIDE = 512
+
+# Phrases operators use to open the Q&A part of an earnings call.
+QA_START = re.compile(
+    r"question[- ]and[- ]answer|questions? and answers?|q\s*&\s*a\s+session|open (?:up )?the (?:call|line) for questions"
+    r"|(?:our|the) first question",
+    re.IGNORECASE,
+)
+# A speaker turn starts with a short capitalized name followed by a colon, e.g. "Tim Cook: ...".
+SPEAKER_TURN = re.compile(r"(?:^|\n|(?<=[.!?]) )(?=[A-Z][\w.'-]*(?: [A-Z][\w.'-]*){0,4}: )")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+SECTION_TITLES = {
+    "prepared_remarks": "prepared remarks",
+    "qa": "Q&A session",
+}
+
+MAP_PROMPT = """
+                You are helping a financial analyst summarize a long earnings call for the ticker {ticker}.
+                Below is part {part} of {parts} of the call, taken from the {section}.
+                Extract every financial figure, guidance, success, challenge and future plan mentioned, keeping the numbers exact.
+                For Q&A, keep the substance of each important question and answer. Be concise and do not add an introduction.
+                """
+
+REDUCE_PROMPT = """
+                The earnings call was too long to read at once, so it was condensed part by part.
+                The notes below cover the whole call in order; write the article from them.
+                """
+
+_encoding = None
+
+
+def count_tokens(text):
+    """
+    Count tokens the way the OpenAI models do, or estimate (~4 characters per token) without tiktoken.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            # Imported here rather than at the top, as it slows down starting the CLI.
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except ImportError:  # Fall back to a character-based estimate.
+            _encoding = False
+        except Exception as e:  # The encoding is downloaded on first use.
+            print(f"Falling back to estimated token counts: {e}")
+            _encoding = False
+    if not _encoding:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def image_tokens(width, height, detail="high"):
+    """
+    Vision tokens OpenAI charges for an image of the given size: 85 at low
+    detail; at high detail 85 plus 170 per 512px tile after scaling the image
+    to fit 2048x2048 and its shorter side down to 768.
+    """
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def _open_pdf(pdf_path):
+    try:
+        import pymupdf as fitz
+    except ImportError:  # PyMuPDF before 1.24.3
+        import fitz
+    return fitz.open(pdf_path)
+
+
+class PageImage:
+    """
+    Reference to a PDF page to attach as an image. Only the path, page number
+    and rendering settings are kept; the page is rendered and base64 encoded
+    when the request is serialized (see `serialize_content`), so a prompt
+    holding a long deck costs almost no memory until it is sent.
+    """
+    def __init__(self, pdf_path, page_number, width, height, max_side=None, quality=None, detail="high"):
+        """
+        :param width: Page width in points, from the PDF page rectangle.
+        :param height: Page height in points.
+        :param max_side: Longest side of the rendered image in pixels.
+        """
+        self.pdf_path = pdf_path
+        self.page_number = page_number
+        self.max_side = max_side or image_max_side
+        self.quality = quality or image_jpeg_quality
+        self.detail = detail
+        self.page_size = (width, height)
+        self.scale = self.max_side / max(width, height, 1)
+        self.width = max(1, round(width * self.scale))
+        self.height = max(1, round(height * self.scale))
+        stat = os.stat(pdf_path)
+        self.version = (stat.st_size, stat.st_mtime_ns)
+
+    @property
+    def tokens(self):
+        return image_tokens(self.width, self.height, self.detail)
+
+    def low_detail(self):
+        """
+        :return: The same page rendered smaller, at the low detail level.
+        """
+        return PageImage(self.pdf_path, self.page_number, *self.page_size,
+                         max_side=LOW_DETAIL_MAX_SIDE, quality=self.quality, detail="low")
+
+    def fingerprint(self):
+        """
+        Everything that determines the encoded image, for cache keys.
+        """
+        return [self.pdf_path, *self.version, self.page_number, self.max_side, self.quality, self.detail]
+
+    def render(self, doc=None):
+        """
+        :param doc: The already opened PDF, to avoid reopening it for every page.
+        :return: JPEG bytes of the page.
+        """
+        if doc is None:
+            with _open_pdf(self.pdf_path) as doc:
+                return self.render(doc)
+        page = doc[self.page_number]
+        pix = page.get_pixmap(matrix=(self.scale, 0, 0, self.scale, 0, 0), alpha=False)
+        try:
+            return pix.tobytes("jpeg", jpg_quality=self.quality)
+        except TypeError:  # PyMuPDF before 1.22 cannot set the JPEG quality.
+            from PIL import Image
+
+            image_data = BytesIO()
+            # frombuffer wraps the pixmap samples without copying them.
+            Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", 0, 1) \
+                .save(image_data, format="JPEG", quality=self.quality)
+            return image_data.getbuffer()
+
+    def to_part(self, doc=None):
+        """
+        :return: The `image_url` content part for the API.
+        """
+        encoded = base64.b64encode(self.render(doc)).decode("ascii")
+        return {"type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{encoded}", "detail": self.detail}}
+
+
+def serialize_content(content):
+    """
+    Replace `PageImage` references in a prompt array by encoded image parts,
+    opening every PDF only once. Other parts are passed through.
+    """
+    if not any(isinstance(part.get("image_url"), PageImage) for part in content):
+        return content
+    docs = {}
+    try:
+        serialized = []
+        for part in content:
+            image = part.get("image_url")
+            if isinstance(image, PageImage):
+                if image.pdf_path not in docs:
+                    docs[image.pdf_path] = _open_pdf(image.pdf_path)
+                part = image.to_part(docs[image.pdf_path])
+            serialized.append(part)
+        return serialized
+    finally:
+        for doc in docs.values():
+            doc.close()
+
+
+def content_image_tokens(content):
+    """
+    Vision tokens of the `PageImage` parts of a prompt array.
+    """
+    return sum(part["image_url"].tokens for part in content if isinstance(part.get("image_url"), PageImage))
+
+
+def fit_image_budget(content, budget=None):
+    """
+    Keep the page images of a prompt array within `image_token_budget`, e.g.
+    after merging the parts of several files: images that would exceed it are
+    sent at low detail, and those that do not fit even then are left out.
+    :return: New prompt array.
+    """
+    budget = image_token_budget if budget is None else budget
+    used = 0
+    dropped = 0
+    fitted = []
+    for part in content:
+        image = part.get("image_url")
+        if isinstance(image, PageImage):
+            if used + image.tokens > budget and image.detail != "low":
+                image = image.low_detail()
+            if used + image.tokens > budget:
+                dropped += 1
+                continue
+            used += image.tokens
+            part = {"type": "image_url", "image_url": image}
+        fitted.append(part)
+    if dropped:
+        print(f"Image token budget reached, left out {dropped} page image(s).")
+    return fitted
+
+
+def split_sections(transcript):
+    """
+    Split a transcript into the prepared remarks and the Q&A session.
+    :return: List of (section, text) tuples, in order.
+    """
+    match = QA_START.search(transcript)
+    if not match:
+        return [("prepared_remarks", transcript)]
+    # Start the Q&A at the beginning of the turn that announces it.
+    turn_starts = [m.start() for m in SPEAKER_TURN.finditer(transcript, 0, match.start())]
+    start = turn_starts[-1] if turn_starts else match.start()
+    sections = [("prepared_remarks", transcript[:start]), ("qa", transcript[start:])]
+    return [(name, text.strip()) for name, text in sections if text.strip()]
+
+
+def split_units(text, max_tokens):
+    """
+    Break text into speaker turns, falling back to sentences and then to hard
+    cuts for pieces that are still larger than `max_tokens`.
+    """
+    units = []
+    for turn in SPEAKER_TURN.split(text):
+        turn = turn.strip()
+        if not turn:
+            continue
+        if count_tokens(turn) <= max_tokens:
+            units.append(turn)
+            continue
+        for sentence in SENTENCE_END.split(turn):
+            if count_tokens(sentence) <= max_tokens:
+                units.append(sentence)
+            else:
+                step = max_tokens * 4
+                units.extend(sentence[i:i + step] for i in range(0, len(sentence), step))
+    return units
+
+
+def chunk_transcript(transcript, max_tokens=None):
+    """
+    Split a transcript into chunks of at most `max_tokens` tokens, on speaker
+    boundaries and never mixing prepared remarks with Q&A.
+    :return: List of dictionaries with `section`, `text` and `tokens`.
+    """
+    max_tokens = max_tokens or max_chunk_tokens
+    chunks = []
+    for section, text in split_sections(transcript):
+        parts, tokens = [], 0
+        for unit in split_units(text, max_tokens):
+            unit_tokens = count_tokens(unit)
+            if parts and tokens + unit_tokens > max_tokens:
+                chunks.append({"section": section, "text": "\n".join(parts), "tokens": tokens})
+                parts, tokens = [], 0
+            parts.append(unit)
+            tokens += unit_tokens
+        if parts:
+            chunks.append({"section": section, "text": "\n".join(parts), "tokens": tokens})
+    return chunks
 
 
 class PromptPreparation:
     def __init__(self, init_prompt):
         self.content = [{"type": "text", "text": init_prompt}]  # Initialize with the initial prompt
+        self.chunks = []
 
     def process_txt(self, content):
         self.content.append({"type": "text", "text": content})
 
-    def process_file(self, file_path):
+    def process_transcript(self, transcript, max_tokens=None):
+        """
+        Add a transcript to the prompt. Transcripts over `max_tokens` are split
+        into chunks to be summarized separately (see `get_map_prompt_arrays`)
+        instead of being appended whole.
+        :return: True if the transcript was chunked.
+        """
+        max_tokens = max_tokens or max_chunk_tokens
+        if count_tokens(transcript) <= max_tokens:
+            self.process_txt(transcript)
+            return False
+        self.chunks = chunk_transcript(transcript, max_tokens)
+        return True
+
+    def get_map_prompt_arrays(self, ticker):
+        """
+        One prompt array per chunk, asking for condensed notes on that part of the call.
+        """
+        return [
+            [
+                {"type": "text", "text": MAP_PROMPT.format(
+                    ticker=ticker, part=index, parts=len(self.chunks),
+                    section=SECTION_TITLES[chunk["section"]],
+                )},
+                {"type": "text", "text": chunk["text"]},
+            ]
+            for index, chunk in enumerate(self.chunks, start=1)
+        ]
+
+    def get_reduce_prompt_array(self, chunk_summaries):
+        """
+        The final prompt: the original instructions followed by the per-chunk notes.
+        :param chunk_summaries: Responses to `get_map_prompt_arrays`, in the same order.
+        """
+        notes = [
+            {"type": "text", "text": f"Notes on the {SECTION_TITLES[chunk['section']]}, part {index}:\n{summary}"}
+            for index, (chunk, summary) in enumerate(zip(self.chunks, chunk_summaries), start=1)
+        ]
+        return self.content + [{"type": "text", "text": REDUCE_PROMPT}] + notes
+
+    def process_file(self, file_path, pdf_mode="text", max_pages=None):
         """
         Process a single file and add its content to the prompt array.
         :param file_path: Path to the file to process.
+        :param pdf_mode: "text" to extract PDF text, "images" to attach rendered pages.
+        :param max_pages: Maximum number of PDF pages to add.
         """
-        if file_path.endswith(".pdf"):
-            self._process_pdf(file_path)
-        elif file_path.endswith(".txt"):
+        if file_path.lower().endswith(".pdf"):
+            self._process_pdf(file_path, mode=pdf_mode, max_pages=max_pages)
+        elif file_path.lower().endswith(".txt"):
             self._process_txt(file_path)
         else:
             print(f"Unsupported file type: {file_path}")
@@ -31,59 +346,38 @@ class PromptPreparation:
         """
         return self.content
 
-    # def _process_pdf(self, pdf_path):
-        # """
-        # Extract text from a PDF file and add it to the content array.
-        # :param pdf_path: Path to the PDF file.
-        # """
-        # print(f"Processing PDF: {pdf_path}")
-        # doc = fitz.open(pdf_path)
-        # for page_num in range(len(doc)):
-        #     page = doc[page_num]
-
-        #     # Extract text from the page
-        #     text_content = page.get_text()
-
-        #     # Append the extracted text to the content array
-        #     self.content.append({
-        #         "type": "text",
-        #         "text": text_content.strip()  # Strip to clean up extra whitespace
-        #     })
-        # doc.close()
-
-    # def _process_pdf(self, pdf_path):
-    #     """
-    #     Convert a PDF to in-memory JPEG images, encode them in base64, and add to the prompt array.
-    #     :param pdf_path: Path to the PDF file.
-    #     """
-    #     print(f"Processing PDF: {pdf_path}")
-    #     doc = fitz.open(pdf_path)
-    #     for page_num in range(len(doc)):
-    #         page = doc[page_num]
-    #         pix = page.get_pixmap()
-
-    #         # Convert pixmap to in-memory JPEG
-    #         image_data = self._pixmap_to_jpeg(pix)
-
-    #         # Encode image and append to content
-    #         mime_type, img_b64_str = self._encode_image_base64(image_data)
-    #         self.content.append({
-    #             "type": "image_url",
-    #             "image_url": {"url": f"data:{mime_type};base64,{img_b64_str}"}
-    #         })
-    #     doc.close()
-
-    # def _pixmap_to_jpeg(self, pix):
-    #     """
-    #     Convert a PyMuPDF pixmap to in-memory JPEG image.
-    #     :param pix: PyMuPDF Pixmap object.
-    #     :return: BytesIO object containing the JPEG image data.
-    #     """
-    #     img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-    #     image_data = BytesIO()
-    #     img.save(image_data, format="JPEG")
-    #     image_data.seek(0)
-    #     return image_data
+    def _process_pdf(self, pdf_path, mode="text", max_pages=None):
+        """
+        Add a PDF to the content array page by page, either as extracted text or
+        as page images. Pages are loaded one at a time, so memory stays bounded
+        by the largest page rather than the whole document. Images are added as
+        `PageImage` references within `image_token_budget`: pages that would
+        exceed it at full detail are sent at low detail, and once even that
+        does not fit, the remaining pages are skipped.
+        :param pdf_path: Path to the PDF file.
+        :param mode: "text" or "images".
+        :param max_pages: Stop after this many pages.
+        """
+        print(f"Processing PDF: {pdf_path}")
+        image_tokens_used = content_image_tokens(self.content)
+        with _open_pdf(pdf_path) as doc:
+            for page_num, page in enumerate(doc):
+                if max_pages is not None and page_num >= max_pages:
+                    print(f"Skipping pages after {max_pages} in {pdf_path}")
+                    break
+                if mode == "images":
+                    image = PageImage(pdf_path, page_num, page.rect.width, page.rect.height)
+                    if image_tokens_used + image.tokens > image_token_budget:
+                        image = image.low_detail()
+                    if image_tokens_used + image.tokens > image_token_budget:
+                        print(f"Image token budget reached, skipping pages from {page_num + 1} in {pdf_path}")
+                        break
+                    image_tokens_used += image.tokens
+                    self.content.append({"type": "image_url", "image_url": image})
+                else:
+                    text_content = page.get_text().strip()
+                    if text_content:
+                        self.content.append({"type": "text", "text": text_content})
 
     def _process_txt(self, txt_path):
         """
@@ -94,13 +388,3 @@ class PromptPreparation:
         with open(txt_path, "r", encoding="utf-8") as f:
             text_content = f.read()
         self.content.append({"type": "text", "text": text_content})
-
-    def _encode_image_base64(self, image_data):
-        """
-        Encode in-memory image data to base64.
-        :param image_data: BytesIO object containing the image data.
-        :return: Tuple of MIME type and base64 string.
-        """
-        mime_type = "image/jpeg"
-        img_b64_str = base64.b64encode(image_data.getvalue()).decode("utf-8")
-        return mime_type, img_b64_str
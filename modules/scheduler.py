@@ -0,0 +1,90 @@
+import os
+import math
+import time
+
+
+# Tickers that always go first, comma separated and/or one per line in a file.
+watchlist_env = os.getenv('WATCHLIST', '')
+watchlist_file = os.getenv('WATCHLIST_FILE', 'watchlist.txt')
+
+# Market cap dominates the score (one point per order of magnitude); analyst
+# coverage and the presence of a consensus forecast break ties between
+# companies of similar size.
+ESTIMATE_WEIGHT = 0.05
+MAX_COUNTED_ESTIMATES = 30
+FORECAST_BONUS = 0.5
+
+
+def load_watchlist(path=None):
+    """
+    :return: Set of upper-case tickers from WATCHLIST and the watchlist file.
+    """
+    tickers = {ticker.strip().upper() for ticker in watchlist_env.split(',') if ticker.strip()}
+    path = path or watchlist_file
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                ticker = line.split('#', 1)[0].strip().upper()
+                if ticker:
+                    tickers.add(ticker)
+    return tickers
+
+
+def priority_score(symbol):
+    """
+    Value of summarizing a symbol, from the calendar figures in the entry.
+    """
+    score = math.log10(max(symbol.get('market_cap') or 1, 1))
+    score += ESTIMATE_WEIGHT * min(symbol.get('estimates') or 0, MAX_COUNTED_ESTIMATES)
+    if symbol.get('eps_forecast') is not None:
+        score += FORECAST_BONUS
+    return score
+
+
+def rank_symbols(symbols, watchlist=None):
+    """
+    Order symbols by priority: watchlisted tickers first, then by `priority_score`.
+    The sort is stable, so ties keep calendar order.
+    """
+    watchlist = load_watchlist() if watchlist is None else watchlist
+    return sorted(
+        symbols,
+        key=lambda symbol: (symbol['ticker'].upper() not in watchlist, -priority_score(symbol)),
+    )
+
+
+class RunBudget:
+    """
+    Per-run limits on wall time and OpenAI tokens. Tickers that would start
+    after a limit is reached are skipped; tokens are reserved before each
+    request so concurrent tickers cannot overshoot by much.
+    """
+    def __init__(self, max_seconds=None, max_tokens=None):
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.started = time.monotonic()
+        self.tokens = 0
+        self.skipped = 0
+
+    def out_of_time(self):
+        return self.max_seconds is not None and time.monotonic() - self.started >= self.max_seconds
+
+    def out_of_tokens(self, tokens=0):
+        return self.max_tokens is not None and self.tokens + tokens > self.max_tokens
+
+    def reserve(self, tokens):
+        """
+        Reserve tokens for a request.
+        :return: False (and nothing reserved) if it would exceed the token budget.
+        """
+        if self.out_of_tokens(tokens):
+            return False
+        self.tokens += tokens
+        return True
+
+    def get_stats(self):
+        return {
+            "elapsed_seconds": round(time.monotonic() - self.started, 1),
+            "tokens_reserved": self.tokens,
+            "skipped": self.skipped,
+        }
@@ -0,0 +1,394 @@
+import os
+import io
+import gzip
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+try:
+    import zstandard
+except ImportError:  # Fall back to gzip.
+    zstandard = None
+from modules.metrics import span
+from dotenv import load_dotenv
+load_dotenv()
+
+
+cloudflare_worker_url = os.getenv('DATA_STORE_URL')
+cache_dir = os.getenv('STORE_CACHE_DIR', os.path.join('.cache', 'store'))
+cache_max_bytes = int(os.getenv('STORE_CACHE_MAX_MB', '512')) * 1024 * 1024
+# Compression for new objects: "zstd", "gzip" or "none". Objects are named
+# with the codec's suffix, so existing uncompressed objects stay readable.
+store_codec = os.getenv('STORE_CODEC', 'zstd' if zstandard else 'gzip')
+zstd_level = int(os.getenv('STORE_ZSTD_LEVEL', '10'))
+
+CODEC_SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+READ_SIZE = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the process-wide pooled HTTP session used for all outbound requests.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=32)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def content_hash(content):
+    """
+    SHA-256 of the text, as stored in the `content_hash` column.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def stored_name(filename, codec=None, version=None):
+    """
+    Object name for a file written with the codec, e.g. `AAPL_2024_Q3_summary.txt.zst`.
+    :param version: Content hash to include in the name, for content replacing
+        an existing object: names are never reused for other content, so no
+        cache elsewhere can keep serving the old one.
+    """
+    codec = codec or store_codec
+    if codec == "zstd" and zstandard is None:
+        codec = "gzip"
+    if version:
+        root, extension = os.path.splitext(filename)
+        filename = f"{root}.{version[:16]}{extension}"
+    return filename + CODEC_SUFFIXES.get(codec, "")
+
+
+def codec_of(name):
+    for codec, suffix in CODEC_SUFFIXES.items():
+        if name.endswith(suffix):
+            return codec
+    return "none"
+
+
+def compress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required for .zst objects")
+        return zstandard.ZstdCompressor(level=zstd_level).compress(data)
+    if codec == "gzip":
+        # mtime=0 keeps the output, and so its hash, deterministic.
+        return gzip.compress(data, mtime=0)
+    return data
+
+
+def decompressing_reader(raw, codec):
+    """
+    Binary file object yielding the decompressed content of the `raw` stream.
+    """
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required for .zst objects")
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    return raw
+
+
+def read_text(raw, codec):
+    """
+    Decompress and decode a stream chunk by chunk, without buffering the compressed object.
+    """
+    with io.TextIOWrapper(io.BufferedReader(decompressing_reader(raw, codec), READ_SIZE), encoding="utf-8") as text:
+        return text.read()
+
+
+class _Recorder(io.RawIOBase):
+    """
+    Pass-through reader keeping a copy of the compressed bytes for the local cache.
+    """
+    def __init__(self, raw):
+        self.raw = raw
+        self.chunks = []
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer))
+        if not data:
+            return 0
+        self.chunks.append(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        # The response is closed by the caller.
+        pass
+
+    def getvalue(self):
+        return b"".join(self.chunks)
+
+
+def _temp_path(path):
+    """
+    Scratch name to write `path` under before renaming it into place. Unique
+    per process and thread, as several workers may share a cache directory.
+    """
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+class LocalCache:
+    """
+    On-disk, content-addressed cache with size-bounded LRU eviction.
+    Objects live under `objects/<sha256>`; `index.json` maps store filenames
+    (e.g. `AAPL_2024_Q3_summary.txt`) to their content hash in LRU order.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.objects_directory = os.path.join(directory, "objects")
+        self.index_path = os.path.join(directory, "index.json")
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = OrderedDict()  # filename -> {"hash": ..., "size": ...}
+        os.makedirs(self.objects_directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        for filename, entry in entries:
+            if os.path.exists(self._object_path(entry["hash"])):
+                self.index[filename] = entry
+
+    def _save_index(self):
+        temp_path = _temp_path(self.index_path)
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(list(self.index.items()), f)
+        os.replace(temp_path, self.index_path)
+
+    def _object_path(self, content_hash):
+        return os.path.join(self.objects_directory, content_hash)
+
+    def hash_of(self, filename):
+        """
+        :return: Hash of the bytes cached for the filename, or None.
+        """
+        with self.lock:
+            entry = self.index.get(filename)
+            return entry["hash"] if entry else None
+
+    def get(self, filename):
+        """
+        :return: Cached bytes for the filename, or None on a miss.
+        """
+        with self.lock:
+            entry = self.index.get(filename)
+            if entry is None:
+                return None
+            try:
+                with open(self._object_path(entry["hash"]), "rb") as f:
+                    data = f.read()
+            except OSError:
+                del self.index[filename]
+                return None
+            self.index.move_to_end(filename)
+            return data
+
+    def put(self, filename, data):
+        """
+        Store bytes under the filename and evict least recently used entries over the size bound.
+        :return: Number of evicted entries.
+        """
+        content_hash = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            object_path = self._object_path(content_hash)
+            if not os.path.exists(object_path):
+                temp_path = _temp_path(object_path)
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, object_path)
+            previous = self.index.pop(filename, None)
+            self.index[filename] = {"hash": content_hash, "size": len(data)}
+            if previous and previous["hash"] != content_hash:
+                self._release(previous["hash"])
+            evicted = self._evict()
+            self._save_index()
+            return evicted
+
+    def _release(self, content_hash):
+        # Objects shared by several filenames are only removed with their last reference.
+        if not any(entry["hash"] == content_hash for entry in self.index.values()):
+            try:
+                os.remove(self._object_path(content_hash))
+            except OSError:
+                pass
+
+    def _evict(self):
+        sizes = {entry["hash"]: entry["size"] for entry in self.index.values()}
+        total = sum(sizes.values())
+        evicted = 0
+        while len(self.index) > 1 and total > self.max_bytes:
+            _, entry = self.index.popitem(last=False)
+            evicted += 1
+            if not any(other["hash"] == entry["hash"] for other in self.index.values()):
+                total -= entry["size"]
+                self._release(entry["hash"])
+        return evicted
+
+
+class WorkerStore:
+    """
+    Client for the Cloudflare worker file store with a local read-through /
+    write-through cache. Objects are compressed according to the suffix of
+    their name (see `stored_name`); the cache keeps the compressed bytes.
+    """
+    def __init__(self, base_url=None, cache=None, session=None):
+        """
+        :param base_url: Worker URL; defaults to DATA_STORE_URL.
+        :param cache: `LocalCache` instance; pass False to disable local caching.
+        :param session: requests-compatible session; defaults to the shared pooled one.
+        """
+        self.base_url = base_url or cloudflare_worker_url
+        self.cache = LocalCache(cache_dir, cache_max_bytes) if cache is None else cache or None
+        self.session = session or get_session()
+        self.lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "uploads": 0,
+            "evictions": 0,
+            "bytes_saved": 0,
+            "bytes_downloaded": 0,
+            "bytes_uploaded": 0,
+            "bytes_uncompressed": 0,
+            "uploads_skipped": 0,
+        }
+
+    def _count(self, **increments):
+        with self.lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def download(self, filename):
+        """
+        Return the stored text for the filename, serving it locally when cached.
+        """
+        codec = codec_of(filename)
+        if self.cache:
+            data = self.cache.get(filename)
+            if data is not None:
+                self._count(hits=1, bytes_saved=len(data))
+                return read_text(io.BytesIO(data), codec)
+
+        with span("store_download") as download_span:
+            with self.session.get(f'{self.base_url}/download/{filename}', stream=True) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                recorder = _Recorder(response.raw)
+                text = read_text(recorder, codec)
+            data = recorder.getvalue()
+            download_span["bytes"] = len(data)
+        self._count(misses=1, bytes_downloaded=len(data))
+        if self.cache:
+            self._count(evictions=self.cache.put(filename, data))
+        return text
+
+    def upload(self, filename, content):
+        """
+        Compress text for its object name, upload it to the worker and keep a local copy.
+        Skipped when this machine already uploaded the same bytes under the name.
+        :return: The worker response, or None if the upload was skipped.
+        """
+        raw = content.encode("utf-8")
+        data = compress(raw, codec_of(filename))
+        if self.cache and self.cache.hash_of(filename) == hashlib.sha256(data).hexdigest():
+            self._count(uploads_skipped=1)
+            return None
+        with span("store_upload") as upload_span:
+            upload_span["bytes"] = len(data)
+            response = self.session.post(
+                f'{self.base_url}/upload',
+                files={"file": (filename, data)},
+            )
+            response.raise_for_status()
+        self._count(uploads=1, bytes_uploaded=len(data), bytes_uncompressed=len(raw))
+        if self.cache:
+            self._count(evictions=self.cache.put(filename, data))
+        return response
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class FileStore:
+    """
+    Store in a local directory with the same interface and codecs as
+    `WorkerStore`, for offline runs and tests (`DATA_STORE_URL=file:///path`).
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.stats = {"downloads": 0, "uploads": 0, "uploads_skipped": 0, "bytes_written": 0}
+
+    def _path(self, filename):
+        return os.path.join(self.directory, os.path.basename(filename))
+
+    def download(self, filename):
+        with open(self._path(filename), "rb") as f:
+            text = read_text(f, codec_of(filename))
+        with self.lock:
+            self.stats["downloads"] += 1
+        return text
+
+    def upload(self, filename, content):
+        data = compress(content.encode("utf-8"), codec_of(filename))
+        path = self._path(filename)
+        if os.path.exists(path) and os.path.getsize(path) == len(data):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    with self.lock:
+                        self.stats["uploads_skipped"] += 1
+                    return None
+        temp_path = _temp_path(path)
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.stats["uploads"] += 1
+            self.stats["bytes_written"] += len(data)
+        return path
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+def get_store():
+    """
+    Return the process-wide store, creating it on first use: a `FileStore`
+    for `file://` DATA_STORE_URLs, the `WorkerStore` otherwise.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            url = cloudflare_worker_url or ""
+            if url.startswith("file://"):
+                _store = FileStore(urlsplit(url).path)
+            else:
+                _store = WorkerStore()
+        return _store
@@ -1,109 +1,273 @@
 import os
-from telegram import Bot
 import re
-from telegram.constants import ParseMode
+import time
+import asyncio
+import sqlite3
+from datetime import timedelta
 from dotenv import load_dotenv
+from modules.metrics import span
 
 
 bot_token = os.getenv('TG_BOT_TOKEN')
 channel_id = os.getenv('TG_CHANNEL_ID')  # Replace with your channel username or ID
-bot = Bot(token=bot_token)
+# Built on first use by `get_bot`; importing python-telegram-bot is slow.
+bot = None
+
+outbox_path = os.getenv('TG_OUTBOX_PATH', os.path.join('.cache', 'telegram_outbox.db'))
+# Telegram allows about 20 messages per minute in a channel.
+min_send_interval = float(os.getenv('TG_MIN_SEND_INTERVAL', '3'))
+max_send_attempts = int(os.getenv('TG_MAX_SEND_ATTEMPTS', '5'))
+
+# Characters Telegram MarkdownV2 needs escaped. '*', '_', '~', '[', ']' and '`'
+# are left alone so they still act as markup. The backslash goes first so the
+# escapes added for the others are not doubled.
+_ESCAPES = tuple((char, '\\' + char) for char in '\\()>+-=|{}.!')
+_BOLD = re.compile(r'\*\*(.+?)\*\*', re.DOTALL)
+_STRIKETHROUGH = re.compile(r'~~(.+?)~~', re.DOTALL)
+
 
 def convert_to_telegram_markdown(text):
     """
     Converts standard Markdown to Telegram MarkdownV2, ensuring only unsupported special characters are escaped,
     while retaining valid MarkdownV2 syntax.
     """
-    # Step 2: Remove unsupported Markdown syntax
-    text = text.replace('####', '')  # Remove headings like ###
-    text = text.replace('###', '')
-    text = text.replace('##', '')
-    text = text.replace('#', '')
-
-    # Step 1: Replace standard Markdown syntax with Telegram MarkdownV2 equivalents
-    replacements = [
-        (r'\*\*(.+?)\*\*', r'*\1*'),  # Bold (**text** -> *text*)
-        (r'_(.+?)_', r'_\1_'),        # Italic (_text_ -> _text_)
-        (r'~~(.+?)~~', r'~\1~'),      # Strikethrough (~~text~~ -> ~text~)
-        (r'`(.+?)`', r'`\1`'),        # Inline code (`text` -> `text`)
-        (r'```([\s\S]+?)```', r'```\1```'),  # Code block
-        (r'\[(.+?)\]\((.+?)\)', r'[\1](\2)'),  # Inline links ([text](url) -> [text](url))
-    ]
-
-    for pattern, replacement in replacements:
-        text = re.sub(pattern, replacement, text, flags=re.DOTALL)
+    text = text.replace('#', '')  # Headings are not supported
+    text = _BOLD.sub(r'*\1*', text)  # Bold (**text** -> *text*)
+    text = _STRIKETHROUGH.sub(r'~\1~', text)  # Strikethrough (~~text~~ -> ~text~)
+    # str.replace runs in C and skips absent characters, which beats a
+    # per-character pass in Python on the (mostly non-ASCII) summaries.
+    for char, escaped in _ESCAPES:
+        if char in text:
+            text = text.replace(char, escaped)
+    # A backslash right before a backtick stays single so inline code survives.
+    return text.replace('\\\\`', '\\`')
 
 
+def _safe_cut(text, limit):
+    """
+    Position at or before `limit` to cut `text` at: the last whitespace if any,
+    and never between a backslash and the character it escapes.
+    """
+    cut = text.rfind(' ', 0, limit + 1)
+    if cut <= 0:
+        cut = limit
+    # An odd run of backslashes before the cut means the last one escapes text[cut].
+    backslashes = len(text[:cut]) - len(text[:cut].rstrip('\\'))
+    if backslashes % 2:
+        cut -= 1
+    return cut
 
 
-    # Step 3: Escape Telegram MarkdownV2 special characters not part of the markup
-    # Characters to escape: `_`, `*`, `[`, `]`, `(`, `)`, `~`, `>`, `#`, `+`, `-`, `=`, `|`, `{`, `}`, `.`, `!`
-    # Except when they are part of valid Telegram MarkdownV2 syntax
-    special_characters = r'_*\[\]()~>#+-=|{}.!'
-    escaped_text = re.sub(f'([{re.escape(special_characters)}])', r'\\\1', text)
+def split_message_by_paragraphs(message, max_chunk_size=4096):
+    """
+    Splits a long message into smaller chunks by paragraphs, ensuring each chunk
+    does not exceed the max_chunk_size. Paragraphs that are too long on their
+    own are cut at a space, never inside an escape sequence.
+    """
+    chunks = []
+    current = []  # Paragraphs of the chunk being built
+    current_size = 0
 
-    # Step 4: Restore valid MarkdownV2 syntax that was escaped
-    valid_syntax = [
-        (r'\\\*', r'*'),  # Bold/Italic asterisks
-        (r'\\_', r'_'),   # Italic underscores
-        (r'\\~', r'~'),   # Strikethrough
-        (r'\\`', r'`'),   # Inline code
-        (r'\\\[', r'['),  # Inline links
-        (r'\\\]', r']'),  # Inline links
-#        (r'\\\(', r'('),  # Inline links
-#        (r'\\\)', r')'),   Inline links
-    ]
+    for paragraph in message.split('\n'):
+        while len(paragraph) > max_chunk_size:
+            cut = _safe_cut(paragraph, max_chunk_size)
+            if current:
+                chunks.append('\n'.join(current))
+                current, current_size = [], 0
+            chunks.append(paragraph[:cut])
+            paragraph = paragraph[cut:].lstrip(' ')
 
-    for pattern, replacement in valid_syntax:
-        escaped_text = re.sub(pattern, replacement, escaped_text)
+        if current and current_size + len(paragraph) + 1 > max_chunk_size:
+            chunks.append('\n'.join(current))
+            current, current_size = [], 0
+        current.append(paragraph)
+        current_size += len(paragraph) + (1 if len(current) > 1 else 0)
 
-    return escaped_text
+    if current:
+        chunks.append('\n'.join(current))
 
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
 
+def get_bot():
+    global bot
+    if bot is None:
+        from telegram import Bot
+        bot = Bot(token=bot_token)
+    return bot
 
 
-def split_message_by_paragraphs(message, max_chunk_size=4096):
+class PublishQueue:
     """
-    Splits a long message into smaller chunks by paragraphs, ensuring each chunk
-    does not exceed the max_chunk_size.
+    Durable, rate-limited Telegram outbox.
+    Producers call `enqueue` and return immediately; a background consumer
+    sends messages in order, spacing posts to the same chat by
+    `min_send_interval` and waiting out `RetryAfter` flood control.
+    Messages are stored in a SQLite outbox until fully delivered, so anything
+    left over is resent (from the first undelivered chunk) after a restart.
     """
-    paragraphs = message.split('\n')  # Split message by newlines into paragraphs
-    chunks = []
-    current_chunk = ""
+    def __init__(self, path=None, interval=None):
+        path = path or outbox_path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.interval = min_send_interval if interval is None else interval
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                file_path TEXT,
+                sent_chunks INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            );
+        """)
+        self.connection.commit()
+        self.queue = asyncio.Queue()
+        self.last_sent = {}
+        self.consumer = None
+        self.stats = {"enqueued": 0, "sent": 0, "retries": 0, "failed": 0}
 
-    for paragraph in paragraphs:
-        if len(current_chunk) + len(paragraph) + 1 > max_chunk_size:
-            # If adding this paragraph exceeds the limit, finalize the current chunk
-            chunks.append(current_chunk.strip())
-            current_chunk = paragraph  # Start a new chunk
-        else:
-            # Add paragraph to the current chunk
-            current_chunk += f"\n{paragraph}"
+    def start(self):
+        """
+        Start the consumer and requeue messages left undelivered by a previous run.
+        """
+        if self.consumer is None:
+            pending = self.connection.execute("SELECT id FROM outbox ORDER BY id;").fetchall()
+            for (message_id,) in pending:
+                self.queue.put_nowait(message_id)
+            if pending:
+                print(f"Resuming {len(pending)} undelivered Telegram message(s).")
+            self.consumer = asyncio.create_task(self._consume())
+        return self
 
-    # Add the last chunk if it's not empty
-    if current_chunk:
-        chunks.append(current_chunk.strip())
+    def enqueue(self, message, file_path=None, chat_id=None):
+        """
+        Persist a message and schedule it for delivery.
+        """
+        cursor = self.connection.execute(
+            "INSERT INTO outbox (chat_id, message, file_path, created_at) VALUES (?, ?, ?, ?);",
+            (chat_id or channel_id, message, file_path, time.time()),
+        )
+        self.connection.commit()
+        self.queue.put_nowait(cursor.lastrowid)
+        self.stats["enqueued"] += 1
 
-    return chunks
+    async def drain(self):
+        """
+        Wait until every queued message has been handled, then stop the consumer.
+        """
+        if self.consumer is None:
+            return
+        await self.queue.join()
+        self.consumer.cancel()
+        self.consumer = None
 
-async def publish_to_telegram(message, file_path=None):
-    """
-    Publish a message (and optional file) to a Telegram channel.
-    """
-    try:
+    async def _consume(self):
+        while True:
+            message_id = await self.queue.get()
+            try:
+                await self._deliver(message_id)
+            except Exception as e:
+                print(f"Failed to send message {message_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, message_id):
+        row = self.connection.execute(
+            "SELECT chat_id, message, file_path, sent_chunks FROM outbox WHERE id = ?;", (message_id,)
+        ).fetchone()
+        if row is None:
+            return
+        chat_id, message, file_path, sent_chunks = row
         escaped_message = convert_to_telegram_markdown(message)
 
-        print(message)
-        print(escaped_message)
         if file_path and os.path.exists(file_path):
-            # Send the file with a caption
-            await bot.send_document(chat_id=channel_id, document=open(file_path, "rb"), caption=escaped_message[:1024])
             # Caption must be within 1024 characters
+            parts = [("document", escaped_message[:1024])]
         else:
-            # Split the message by paragraphs and send in chunks
-            chunks = split_message_by_paragraphs(escaped_message)
-            for chunk in chunks:
-                await bot.send_message(chat_id=channel_id, text=chunk, parse_mode=ParseMode.MARKDOWN_V2)
-        print("Message sent successfully.")
-    except Exception as e:
-        print(f"Failed to send message: {e}")
+            parts = [("text", chunk) for chunk in split_message_by_paragraphs(escaped_message)]
+
+        for index in range(sent_chunks, len(parts)):
+            kind, text = parts[index]
+            delivered = await self._send(chat_id, kind, text, file_path)
+            if delivered is None:
+                # Still failing after all attempts; leave it in the outbox for the next run.
+                self.stats["failed"] += 1
+                return
+            if not delivered:
+                self.stats["failed"] += 1
+                break
+            self.connection.execute("UPDATE outbox SET sent_chunks = ? WHERE id = ?;", (index + 1, message_id))
+            self.connection.commit()
+        else:
+            self.stats["sent"] += 1
+            print("Message sent successfully.")
+        self.connection.execute("DELETE FROM outbox WHERE id = ?;", (message_id,))
+        self.connection.commit()
+
+    async def _send(self, chat_id, kind, text, file_path):
+        """
+        Send one part, honouring flood control.
+        :return: True when sent, False if Telegram rejected it, None if it kept failing.
+        """
+        from telegram.constants import ParseMode
+        from telegram.error import BadRequest, NetworkError, RetryAfter
+        bot = get_bot()
+        parse_mode = ParseMode.MARKDOWN_V2
+        for attempt in range(max_send_attempts):
+            wait = self.last_sent.get(chat_id, 0) + self.interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                with span("publish") as publish_span:
+                    publish_span["bytes"] = len(text.encode("utf-8"))
+                    if kind == "document":
+                        with open(file_path, "rb") as document:
+                            await bot.send_document(chat_id=chat_id, document=document, caption=text,
+                                                    parse_mode=parse_mode)
+                    else:
+                        await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                self.last_sent[chat_id] = time.monotonic()
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                print(f"Flood control: retrying in {retry_after}s.")
+                self.stats["retries"] += 1
+                await asyncio.sleep(retry_after)
+            except BadRequest as e:
+                if parse_mode is None:
+                    print(f"Telegram rejected message: {e}")
+                    return False
+                # Usually a MarkdownV2 entity problem; fall back to plain text.
+                print(f"Telegram rejected formatting ({e}), resending as plain text.")
+                parse_mode = None
+                text = re.sub(r'\\(.)', r'\1', text)
+                continue
+            except NetworkError as e:
+                self.stats["retries"] += 1
+                delay = min(60, 2 ** attempt)
+                print(f"Telegram network error ({e}), retrying in {delay}s.")
+                await asyncio.sleep(delay)
+            self.last_sent[chat_id] = time.monotonic()
+        return None
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["pending"] = self.queue.qsize()
+        return stats
+
+
+_publish_queue = None
+
+
+def get_publish_queue():
+    """
+    Return the process-wide publish queue, (re)starting its consumer if it is not running.
+    """
+    global _publish_queue
+    if _publish_queue is None:
+        _publish_queue = PublishQueue()
+    return _publish_queue.start()